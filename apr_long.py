@@ -3,8 +3,9 @@ import json
 import os
 
 from dotenv import load_dotenv
-from web3 import Web3
-from web3.middleware import ExtraDataToPOAMiddleware
+
+from hyperstats.engine import run_pools
+from hyperstats.utils import calc_apr
 
 HYPERDRIVE_REGISTRY = {
     "mainnet": "0xbe082293b646cb619a638d29e8eff7cf2f46aa3a",
@@ -26,10 +27,6 @@ HYPERDRIVE_MORPHO_ABI = None
 with open(os.path.join(current_dir, "src", "abi", "IHyperdriveMorpho.json"), encoding="utf-8") as f:
     HYPERDRIVE_MORPHO_ABI = json.load(f)
 
-HYPERDRIVE_REGISTRY_ABI = None
-with open(os.path.join(current_dir, "src", "abi", "hyperdrive_registry.json"), encoding="utf-8") as f:
-    HYPERDRIVE_REGISTRY_ABI = json.load(f)
-
 def get_pool_details(pool_contract, debug: bool = False, block_number: int | None = None):
     name = pool_contract.functions.name().call()
     config_values = pool_contract.functions.getPoolConfig().call()
@@ -51,24 +48,11 @@ def get_pool_details(pool_contract, debug: bool = False, block_number: int | Non
 
     return config, info, name
 
-def calc_apr(config, info):
-    effective_share_reserves = info['shareReserves'] - info['shareAdjustment']
-    ratio = (config['initialVaultSharePrice']/1e18 * effective_share_reserves) / info['bondReserves']
-    spot_price = pow(ratio, config['timeStretch']/1e18)
-    t = config['positionDuration'] / (365 * 24 * 60 * 60)
-    return (1 - spot_price) / (spot_price * t)
+def display_apr(w3, _network, _idx, pool):
+    pool_to_test_contract = w3.eth.contract(address=w3.to_checksum_address(pool), abi=HYPERDRIVE_MORPHO_ABI)
+    config, info, name = get_pool_details(pool_to_test_contract)
+    apr = calc_apr(config, info)
+    print(f"{name:<58}({pool[:8]}) {apr:>6.2%}")
 
 if __name__ == "__main__":
-    for network, address in HYPERDRIVE_REGISTRY.items():
-        w3 = Web3(Web3.HTTPProvider(f"https://{'eth' if network == 'mainnet' else network}-mainnet.g.alchemy.com/v2/{os.getenv('ALCHEMY_KEY')}"))
-        if network == "linea":
-            w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-        HYPERDRIVE_REGISTRY_CONTRACT = w3.eth.contract(address=w3.to_checksum_address(address), abi=HYPERDRIVE_REGISTRY_ABI)
-        number_of_instances = HYPERDRIVE_REGISTRY_CONTRACT.functions.getNumberOfInstances().call()
-        instance_list = HYPERDRIVE_REGISTRY_CONTRACT.functions.getInstancesInRange(0,number_of_instances).call()
-
-        for pool in instance_list:
-            pool_to_test_contract = w3.eth.contract(address=w3.to_checksum_address(pool), abi=HYPERDRIVE_MORPHO_ABI)
-            config, info, name = get_pool_details(pool_to_test_contract)
-            apr = calc_apr(config, info)
-            print(f"{name:<58}({pool[:8]}) {apr:>6.2%}")
+    run_pools(display_apr, list(HYPERDRIVE_REGISTRY))
@@ -0,0 +1,29 @@
+# %%
+import csv
+import sys
+from datetime import datetime, timedelta
+
+from hyperstats.timeseries import TIMESERIES_COLUMNS, get_pool_timeseries, get_pool_timeseries_by_date
+from hyperstats.utils import get_instance_list
+
+# usage: python pool_history.py <network> <pool index> <from> [to] [stride]
+# from and to are block numbers with stride in blocks (default 7200),
+# or YYYY-MM-DD dates with stride in days (default 1), e.g. 0.25 for every 6 hours
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+if __name__ == "__main__":
+    network = sys.argv[1]
+    w3, instance_list = get_instance_list(network)
+    pool = instance_list[int(sys.argv[2])]
+    start = sys.argv[3]
+    end = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] != "latest" else None
+    stride = sys.argv[5] if len(sys.argv) > 5 else None
+    if start.isdigit():
+        series = get_pool_timeseries(w3, pool, int(start), int(end) if end else None, stride=int(stride or 7200))
+    else:
+        series = get_pool_timeseries_by_date(w3, pool, parse_date(start), parse_date(end) if end else None, stride=timedelta(days=float(stride or 1)))
+    writer = csv.writer(sys.stdout)
+    writer.writerow(TIMESERIES_COLUMNS)
+    writer.writerows(zip(*(series[column] for column in TIMESERIES_COLUMNS)))
@@ -1 +1,12 @@
-from .utils import get_hyperdrive_participants, get_pool_details, get_pool_positions, get_trade_details, get_tvl_for_network, get_tvl_for_pool, get_instance_list
+from .utils import (
+    build_position_ledger,
+    get_hyperdrive_participants,
+    get_instance_list,
+    get_network_state,
+    get_pool_details,
+    get_pool_positions,
+    get_pool_snapshot,
+    get_trade_details,
+    get_tvl_for_network,
+    get_tvl_for_pool,
+)
@@ -0,0 +1,175 @@
+from hyperstats.constants import HYPERDRIVE_MORPHO_ABI, ZERO_ADDRESS
+from hyperstats.timeseries import sample_pool
+from hyperstats.utils import decode_asset_id, get_pool_deployment
+from hyperstats.web3_utils import fetch_events_logs_parallel
+
+# pool events that change rewardable TVL, on top of the TransferSingle logs that move positions
+BOUNDARY_EVENTS = ("AddLiquidity", "RemoveLiquidity", "OpenShort", "CloseShort", "RedeemWithdrawalShares", "CreateCheckpoint")
+
+# scale of the reward-per-balance accumulators, so their floor division loses nothing noticeable
+ACCRUAL_PRECISION = 10**36
+
+# positions sharing each rewardable TVL, by asset id prefix (longs earn nothing)
+REWARD_GROUPS = {0: "lp", 3: "lp", 2: "short"}
+
+class RewardAccrual:
+    """Time-weighted rewardable TVL of every user of a pool, built incrementally from its events.
+
+    Between two event boundaries a pool's `lp_rewardable_tvl` and `short_rewardable_tvl` are
+    constant, and so are its positions. Each group's TVL is split pro rata over the balances
+    of its positions, like `get_pool_positions` does, and integrated over block time. A
+    reward-per-balance accumulator per group makes every boundary cost O(1) plus the users
+    whose balances changed, however many users there are.
+
+    Pool TVL is only read at boundaries: blocks with `TransferSingle` or `BOUNDARY_EVENTS`
+    logs, plus every `checkpoint_interval` blocks if set, to catch balance changes that emit
+    no pool event. Reads go through `sample_pool`, so they are batched and cached.
+    """
+
+    def __init__(self, w3, pool, checkpoint_interval: int | None = None):
+        self.w3 = w3
+        self.pool_contract = w3.eth.contract(address=w3.to_checksum_address(pool), abi=HYPERDRIVE_MORPHO_ABI)
+        self.checkpoint_interval = checkpoint_interval
+        deployment_block, _ = get_pool_deployment(w3, self.pool_contract.address)
+        self.block = deployment_block - 1  # last block processed
+        self.timestamp = None  # timestamp of the last block processed
+        self.ledger = {}  # (user, asset_id) -> balance
+        self.balances = {}  # (user, group) -> balance earning rewards
+        self.group_balances = {"lp": 0, "short": 0}
+        self.tvl = {"lp": 0, "short": 0}  # rewardable TVL since the last boundary
+        self.accumulators = {"lp": 0, "short": 0}  # TVL-seconds per unit of balance, scaled by ACCRUAL_PRECISION
+        self.pool_integrals = {"lp": 0, "short": 0}  # TVL-seconds accrued to positions
+        self._integrals = {}  # (user, group) -> scaled TVL-seconds, settled up to the user's checkpoint
+        self._checkpoints = {}  # (user, group) -> accumulator at the user's last settlement
+
+    def _settle(self, key) -> None:
+        group = key[1]
+        accrued = self.balances.get(key, 0) * (self.accumulators[group] - self._checkpoints.get(key, 0))
+        self._integrals[key] = self._integrals.get(key, 0) + accrued
+        self._checkpoints[key] = self.accumulators[group]
+
+    def _move(self, user: str, asset_id: int, delta: int) -> None:
+        """Change a position's balance, settling its owner's accrual first."""
+        key = (user, asset_id)
+        old_balance = self.ledger.get(key, 0)
+        self.ledger[key] = old_balance + delta
+        group = REWARD_GROUPS.get(decode_asset_id(asset_id)[0])
+        if group is None:
+            return
+        # like get_pool_positions, dust balances of 1 or less earn nothing
+        old_eligible = old_balance if old_balance > 1 else 0
+        new_eligible = self.ledger[key] if self.ledger[key] > 1 else 0
+        if new_eligible == old_eligible:
+            return
+        self._settle((user, group))
+        self.balances[(user, group)] = self.balances.get((user, group), 0) + new_eligible - old_eligible
+        self.group_balances[group] += new_eligible - old_eligible
+
+    def _apply_transfer(self, transfer) -> None:
+        # same rules as apply_transfer_single, including the zero address mint at initialization
+        from_addr = transfer["args"]["from"]
+        to_addr = transfer["args"]["to"]
+        if from_addr != ZERO_ADDRESS:
+            self._move(from_addr, transfer["args"]["id"], -transfer["args"]["value"])
+        if to_addr != ZERO_ADDRESS or from_addr == ZERO_ADDRESS:
+            self._move(to_addr, transfer["args"]["id"], transfer["args"]["value"])
+
+    def _accrue(self, timestamp: int) -> None:
+        """Accrue each group's TVL from the last boundary up to `timestamp`."""
+        if self.timestamp is not None:
+            elapsed = timestamp - self.timestamp
+            for group, group_balance in self.group_balances.items():
+                if group_balance > 0:
+                    self.accumulators[group] += self.tvl[group] * elapsed * ACCRUAL_PRECISION // group_balance
+                    self.pool_integrals[group] += self.tvl[group] * elapsed
+        self.timestamp = timestamp
+
+    def advance(self, to_block: int | None = None) -> None:
+        """Process every boundary after the last processed block, up to `to_block` (default latest)."""
+        if to_block is None:
+            to_block = self.w3.eth.get_block_number()
+        from_block = self.block + 1
+        if to_block < from_block:
+            return
+        label = f"Hyperdrive accrual {self.pool_contract.address}"
+        transfers = fetch_events_logs_parallel(self.pool_contract.events.TransferSingle(), from_block, to_block, label=label)
+        boundaries = {transfer["blockNumber"] for transfer in transfers}
+        for event_name in BOUNDARY_EVENTS:
+            logs = fetch_events_logs_parallel(getattr(self.pool_contract.events, event_name)(), from_block, to_block, label=label)
+            boundaries.update(log["blockNumber"] for log in logs)
+        if self.checkpoint_interval:
+            # every multiple of the interval in range, so the grid does not depend on how runs are split
+            boundaries.update(range(-(-from_block // self.checkpoint_interval) * self.checkpoint_interval, to_block + 1, self.checkpoint_interval))
+        boundaries.add(to_block)
+
+        transfers_by_block = {}
+        for transfer in transfers:
+            transfers_by_block.setdefault(transfer["blockNumber"], []).append(transfer)
+        boundaries = sorted(boundaries)
+        for block_number, sample in zip(boundaries, sample_pool(self.w3, self.pool_contract.address, boundaries)):
+            self._accrue(sample["timestamp"])
+            for transfer in sorted(transfers_by_block.get(block_number, []), key=lambda transfer: transfer["logIndex"]):
+                self._apply_transfer(transfer)
+            # pool state read at a block is the state after it, which holds until the next boundary
+            self.tvl = {
+                "lp": sample["vaultSharesBalance"] - sample["shortsOutstanding"],
+                "short": sample["shortsOutstanding"],
+            }
+            self.block = block_number
+
+    def get_accrued(self) -> dict:
+        """Return each user's accrued rewardable TVL in wei-seconds, by (user, group).
+
+        Accrual runs up to the last processed block, whose TVL starts accruing at the next one.
+        """
+        for key in self.balances:
+            self._settle(key)
+        return {key: integral // ACCRUAL_PRECISION for key, integral in self._integrals.items()}
+
+    def get_rewardable(self) -> dict:
+        """Return each user's current share of rewardable TVL, by (user, group), rounded down."""
+        return {
+            (user, group): self.tvl[group] * balance // self.group_balances[group]
+            for (user, group), balance in self.balances.items()
+            if balance > 0
+        }
+
+    def reconcile(self, pool_positions) -> None:
+        """Check the accrual state against a `get_pool_positions` snapshot at the last processed block.
+
+        Position balances must match exactly. Each user's current rewardable TVL may only differ
+        by the rounding of the snapshot's largest remainder split, one unit per position. The
+        accrued totals must add up to the pool's TVL integral, within the accumulators' rounding.
+
+        Raises:
+            ValueError: If the snapshot and the accrual state disagree
+        """
+        snapshot_balances = {}
+        snapshot_rewardable = {}
+        group_positions = {"lp": 0, "short": 0}
+        for user, _, prefix, timestamp, balance, rewardable in pool_positions:
+            snapshot_balances[(str(user), (int(prefix) << 248) | int(timestamp))] = int(balance)
+            group = REWARD_GROUPS.get(int(prefix))
+            if group is not None:
+                snapshot_rewardable[(str(user), group)] = snapshot_rewardable.get((str(user), group), 0) + int(rewardable)
+                group_positions[group] += 1
+        ledger_balances = {key: balance for key, balance in self.ledger.items() if balance > 1}
+        if ledger_balances != snapshot_balances:
+            mismatched = sorted(set(ledger_balances.items()) ^ set(snapshot_balances.items()))[:5]
+            raise ValueError(f"Accrual balances differ from the snapshot at block {self.block}, e.g. {mismatched}")
+        rewardable = self.get_rewardable()
+        for key in set(rewardable) | set(snapshot_rewardable):
+            if abs(rewardable.get(key, 0) - snapshot_rewardable.get(key, 0)) > group_positions[key[1]]:
+                raise ValueError(f"Rewardable TVL of {key} at block {self.block}: accrual={rewardable.get(key, 0)} snapshot={snapshot_rewardable.get(key, 0)}")
+        accrued = self.get_accrued()
+        for group, pool_integral in self.pool_integrals.items():
+            users_integral = sum(integral for (_, user_group), integral in accrued.items() if user_group == group)
+            # each user's total is floored once, the accumulators' own rounding is far below a wei-second
+            if not 0 <= pool_integral - users_integral <= len(accrued) + 1:
+                raise ValueError(f"Accrued {group} TVL-seconds {users_integral} do not add up to the pool's {pool_integral}")
+
+def accrue_rewards(w3, pool, to_block: int | None = None, checkpoint_interval: int | None = None) -> RewardAccrual:
+    """Build the time-weighted reward accrual of a pool from its deployment up to `to_block`."""
+    accrual = RewardAccrual(w3, pool, checkpoint_interval=checkpoint_interval)
+    accrual.advance(to_block)
+    return accrual
@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+
+from hyperstats.constants import CONFIRMATION_DEPTH
+from hyperstats.event_store import add_block_timestamps, get_block_timestamp_bracket, open_store
+from hyperstats.web3_utils import get_chain_id
+
+
+def get_block_by_timestamp(w3, timestamp: int, cache: bool = True, confirmations: int = CONFIRMATION_DEPTH) -> int:
+    """Return the first block with a timestamp at or after `timestamp`, or the latest block.
+
+    The search starts from the closest blocks already in the network's timestamp index and
+    narrows the bracket by interpolating on block time. A probe that fails to halve the
+    bracket is followed by a bisection step, so uneven block times cannot slow it to a crawl.
+    On chains with regular block times this takes a few header fetches, and none when the
+    index already brackets the timestamp tightly. Every final header fetched is added to
+    the index.
+
+    Args:
+        w3: Web3 instance
+        timestamp: Unix timestamp in seconds
+        cache: Read and extend the timestamp index in the event store
+        confirmations: Depth at which blocks are treated as final
+    """
+    chain_id = get_chain_id(w3)
+    conn = open_store() if cache else None
+    low, high = get_block_timestamp_bracket(conn, chain_id, timestamp) if cache else (None, None)
+    # blocks below a stored block are final, otherwise finality is set by the head
+    final_block = high[0] if high is not None else None
+    fetched = []
+
+    def fetch(block_identifier):
+        header = w3.eth.get_block(block_identifier)
+        fetched.append((header["number"], header["timestamp"]))
+        return header["number"], header["timestamp"]
+
+    try:
+        if high is None:
+            high = fetch("latest")
+            final_block = high[0] - confirmations
+            if high[1] < timestamp:
+                return high[0]
+        if low is None:
+            low = fetch(0)
+            if low[1] >= timestamp:
+                return low[0]
+        bisect = False
+        # invariant: low's timestamp is before `timestamp`, high's is at or after it
+        while high[0] - low[0] > 1:
+            span = high[0] - low[0]
+            if bisect:
+                guess = (low[0] + high[0]) // 2
+            else:
+                guess = low[0] - (-(timestamp - low[1]) * span // (high[1] - low[1]))
+            guess = min(max(guess, low[0] + 1), high[0] - 1)
+            probe = fetch(guess)
+            if probe[1] < timestamp:
+                low = probe
+            else:
+                high = probe
+            bisect = not bisect and high[0] - low[0] > span // 2
+        return high[0]
+    finally:
+        if cache:
+            add_block_timestamps(conn, chain_id, [(number, block_timestamp) for number, block_timestamp in fetched if number <= final_block])
+            conn.close()
+
+def get_block_by_date(w3, date: datetime, cache: bool = True) -> int:
+    """Return the first block at or after a date, taking naive datetimes as UTC."""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return get_block_by_timestamp(w3, int(date.timestamp()), cache=cache)
@@ -7,6 +7,43 @@ from dotenv import load_dotenv
 load_dotenv()
 ALCHEMY_KEY = os.getenv("ALCHEMY_KEY")
 PAGE_SIZE = int(os.getenv("PAGE_SIZE") or 1000000)
+MULTICALL_BATCH_SIZE = int(os.getenv("MULTICALL_BATCH_SIZE") or 500)
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE") or 100)
+LOG_FETCH_WORKERS = int(os.getenv("LOG_FETCH_WORKERS") or 4)
+# maximum number of network and pool reads in flight at once in `hyperstats.engine`
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY") or 8)
+EVENT_STORE_PATH = os.getenv("EVENT_STORE_PATH") or "cache/hyperstats.db"
+# blocks below head - CONFIRMATION_DEPTH are treated as final by incremental syncs
+CONFIRMATION_DEPTH = int(os.getenv("CONFIRMATION_DEPTH") or 64)
+# concurrent label lookups per backend in query_holders
+LABEL_CONCURRENCY = {
+    "mainnet": int(os.getenv("LABEL_MAINNET_CONCURRENCY") or 8),
+    "base": int(os.getenv("LABEL_BASE_CONCURRENCY") or 8),
+    "explorer": int(os.getenv("LABEL_EXPLORER_CONCURRENCY") or 2),
+}
+# seconds before a cached address label is resolved again, None never expires
+ADDRESS_LABEL_TTLS = {
+    "contract": None,  # deployed code stays deployed
+    "not_contract": 7 * 24 * 3600,  # counterfactual wallets get deployed later
+    "safe": 30 * 24 * 3600,  # Safe flag and version
+    "owners": 24 * 3600,  # Safe owners and threshold
+    "ens_name": 7 * 24 * 3600,
+    "bns_name": 7 * 24 * 3600,
+    "explorer_tag": 90 * 24 * 3600,
+    "no_explorer_tag": 30 * 24 * 3600,  # addresses get tagged over time
+}
+# block explorers scraped for address tags, overridable to point at a mirror or a local stub
+EXPLORER_URLS = {
+    "etherscan": os.getenv("ETHERSCAN_URL") or "https://etherscan.io",
+    "basescan": os.getenv("BASESCAN_URL") or "https://basescan.org",
+}
+# requests per second allowed to each explorer host, with bursts of up to EXPLORER_BURST
+EXPLORER_RATE_LIMIT = float(os.getenv("EXPLORER_RATE_LIMIT") or 4)
+EXPLORER_BURST = int(os.getenv("EXPLORER_BURST") or 8)
+# largest holders listed by query_holders, each of which costs label lookups
+HOLDERS_TOP_N = int(os.getenv("HOLDERS_TOP_N") or 100)
+# blocks between stored holder balance checkpoints of an ERC20 token
+HOLDER_CHECKPOINT_INTERVAL = int(os.getenv("HOLDER_CHECKPOINT_INTERVAL") or 50000)
 
 HYPERDRIVE_REGISTRY = {
     "mainnet": "0xbe082293b646cb619a638d29e8eff7cf2f46aa3a",
@@ -15,7 +52,18 @@ HYPERDRIVE_REGISTRY = {
     "base": "0x6668310631Ad5a5ac92dC9549353a5BaaE16C666",
 }
 
+CHAIN_IDS = {
+    "mainnet": 1,
+    "gnosis": 100,
+    "linea": 59144,
+    "base": 8453,
+}
+
 ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
+ETH_ADDRESS = '0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE'
+
+# Multicall3 is deployed at the same address on every network we support
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
 
 # Get the directory of the current file
 current_dir = os.path.dirname(__file__)
@@ -67,6 +115,43 @@ SAFE_ABI = [
     }
 ]
 
+# Subset of the Multicall3 ABI used for batched reads
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"name": "target", "type": "address"},
+                    {"name": "allowFailure", "type": "bool"},
+                    {"name": "callData", "type": "bytes"}
+                ],
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"name": "success", "type": "bool"},
+                    {"name": "returnData", "type": "bytes"}
+                ],
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "addr", "type": "address"}],
+        "name": "getEthBalance",
+        "outputs": [{"name": "balance", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
 # Vesting contract ABI
 VESTING_ABI = [
     {
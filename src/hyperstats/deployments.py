@@ -0,0 +1,99 @@
+import threading
+
+from hexbytes import HexBytes
+
+from hyperstats.constants import (
+    CHAIN_IDS,
+    CONFIRMATION_DEPTH,
+    HYPERDRIVE_FACTORY_ABI,
+    HYPERDRIVE_REGISTRY,
+    HYPERDRIVE_REGISTRY_ABI,
+)
+from hyperstats.event_store import append_deployments, get_deployment, get_sync_cursor, open_store
+from hyperstats.web3_utils import fetch_events_logs_parallel, find_first_code_block, get_chain_id
+
+# chains whose index was already refreshed by this process
+_synced_chains = set()
+# serializes index refreshes when pools of one chain are read from several threads
+_sync_lock = threading.Lock()
+
+def decode_extra_data(extra_data) -> HexBytes:
+    """Strip the left padding from an address packed into a pool's extraData."""
+    extra_data = HexBytes(extra_data)
+    if extra_data[:12] == HexBytes('0x000000000000000000000000'):
+        extra_data = HexBytes(extra_data[12:])
+    return extra_data
+
+def get_registry_factories(w3, network) -> set:
+    """Return the factories that deployed the pools listed in a network's registry."""
+    registry = w3.eth.contract(address=w3.to_checksum_address(HYPERDRIVE_REGISTRY[network]), abi=HYPERDRIVE_REGISTRY_ABI)
+    number_of_instances = registry.functions.getNumberOfInstances().call()
+    instance_list = registry.functions.getInstancesInRange(0, number_of_instances).call()
+    instance_infos = registry.functions.getInstanceInfos(instance_list).call()
+    return {factory for _, factory in instance_infos}
+
+def sync_deployment_index(w3, network: str | None = None, conn=None, confirmations: int = CONFIRMATION_DEPTH) -> None:
+    """Index every pool deployment on a network from its factories' `Deployed` events.
+
+    Each factory is scanned once from its own deployment block, then only for new blocks.
+    Only blocks at least `confirmations` deep are indexed, so the index never needs to be
+    rewound after a reorg; pools younger than that are left to `get_first_contract_block`.
+
+    Args:
+        w3: Web3 instance
+        network: Network name, derived from the chain id if omitted
+        conn: Optional event store connection
+        confirmations: Depth at which blocks are treated as final
+    """
+    chain_id = get_chain_id(w3)
+    if network is None:
+        network = next(name for name, network_chain_id in CHAIN_IDS.items() if network_chain_id == chain_id)
+    own_conn = conn is None
+    if own_conn:
+        conn = open_store()
+    final_block = w3.eth.get_block_number() - confirmations
+    for factory in sorted(get_registry_factories(w3, network)):
+        cursor = get_sync_cursor(conn, chain_id, factory, stream="Deployed")
+        start_block = cursor + 1 if cursor is not None else find_first_code_block(w3, factory)
+        if start_block > final_block:
+            continue
+        factory_contract = w3.eth.contract(address=factory, abi=HYPERDRIVE_FACTORY_ABI)
+        deployments = fetch_events_logs_parallel(
+            contract_event=factory_contract.events.Deployed(),
+            from_block=start_block,
+            to_block=final_block,
+            label=f"Hyperdrive deployments {factory}",
+        )
+        append_deployments(conn, chain_id, factory, deployments, final_block)
+    _synced_chains.add(chain_id)
+    if own_conn:
+        conn.close()
+
+def get_deployment_info(w3, pool, cache: bool = True) -> tuple[int, str, HexBytes] | None:
+    """Look up a pool's deployment in the network's deployment index.
+
+    The index is refreshed at most once per process and chain, and only when the pool
+    is not in it yet. Without `cache`, the index is not used at all.
+
+    Returns:
+        tuple | None: (deployment_block, transaction_hash, extra_data), or None for pools
+            that are not indexed, e.g. on networks without a registry
+    """
+    if not cache:
+        return None
+    chain_id = get_chain_id(w3)
+    if chain_id not in CHAIN_IDS.values():
+        return None
+    pool = w3.to_checksum_address(pool)
+    conn = open_store()
+    deployment = get_deployment(conn, chain_id, pool)
+    if deployment is None and chain_id not in _synced_chains:
+        with _sync_lock:
+            if chain_id not in _synced_chains:
+                sync_deployment_index(w3, conn=conn)
+        deployment = get_deployment(conn, chain_id, pool)
+    conn.close()
+    if deployment is None:
+        return None
+    deployment_block, transaction_hash, extra_data = deployment
+    return deployment_block, transaction_hash, decode_extra_data(extra_data)
@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import io
+import sys
+
+from hyperstats.constants import MAX_CONCURRENCY
+from hyperstats.utils import get_instance_list
+from hyperstats.web3_utils import create_w3
+
+# buffer collecting the output of the job running in the current context, if any
+_job_output = contextvars.ContextVar("job_output", default=None)
+
+class _JobStdout:
+    """Stdout proxy sending prints made inside a job to that job's buffer."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = _job_output.get()
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def _run_network(network_fn, network):
+    return network_fn(create_w3(network), network)
+
+def _run_job(fn, *args):
+    buffer = io.StringIO()
+    _job_output.set(buffer)
+    return fn(*args), buffer.getvalue()
+
+async def _run_blocking(semaphore, fn, *args) -> tuple:
+    """Run a blocking job in a worker thread once a slot is free, returning (result, output)."""
+    async with semaphore:
+        # to_thread runs the job in a copy of this context, so its buffer stays private
+        return await asyncio.to_thread(_run_job, fn, *args)
+
+async def _run_ordered(jobs, stdout) -> list:
+    """Await jobs in submission order, writing each one's output as soon as its turn comes."""
+    results = []
+    for job in jobs:
+        result, output = await job
+        stdout.write(output)
+        results.append(result)
+    return results
+
+async def run_networks_async(network_fn, networks, max_concurrency: int = MAX_CONCURRENCY) -> dict:
+    """Run `network_fn(w3, network)` for several networks concurrently.
+
+    Jobs run in worker threads, at most `max_concurrency` at a time. Whatever a job prints
+    is buffered and written out in the order of `networks`, so the output does not depend
+    on which job finishes first.
+
+    Returns:
+        dict: Result of `network_fn` by network
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    stdout = sys.stdout
+    sys.stdout = _JobStdout(stdout)
+    try:
+        jobs = [asyncio.ensure_future(_run_blocking(semaphore, _run_network, network_fn, network)) for network in networks]
+        return dict(zip(networks, await _run_ordered(jobs, stdout)))
+    finally:
+        sys.stdout = stdout
+
+async def run_pools_async(pool_fn, networks, pool_index: int | None = None, max_concurrency: int = MAX_CONCURRENCY) -> dict:
+    """Run `pool_fn(w3, network, idx, pool)` for the registry pools of several networks concurrently.
+
+    Every network's instance list is read concurrently, and each pool is scheduled as soon
+    as its network's list arrives. All jobs share one cap of `max_concurrency`, so the total
+    time is set by the slowest pools rather than the sum of all of them. Output is written
+    in network and registry order, as for `run_networks_async`.
+
+    Args:
+        pool_fn: Blocking function called with the network's Web3 instance, the network name,
+            the pool's registry index and the pool address
+        networks: Network names
+        pool_index: Only run the pool at this registry index
+        max_concurrency: Maximum number of jobs in flight
+
+    Returns:
+        dict: Results of `pool_fn` in registry order, by network
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    stdout = sys.stdout
+    sys.stdout = _JobStdout(stdout)
+
+    async def schedule_pools(network):
+        (w3, instance_list), output = await _run_blocking(semaphore, get_instance_list, network)
+        indexed_pools = enumerate(instance_list) if pool_index is None else [(pool_index, instance_list[pool_index])]
+        return output, [asyncio.ensure_future(_run_blocking(semaphore, pool_fn, w3, network, idx, pool)) for idx, pool in indexed_pools]
+
+    try:
+        network_jobs = [asyncio.ensure_future(schedule_pools(network)) for network in networks]
+        results = {}
+        for network, network_job in zip(networks, network_jobs):
+            output, pool_jobs = await network_job
+            stdout.write(output)
+            results[network] = await _run_ordered(pool_jobs, stdout)
+        return results
+    finally:
+        sys.stdout = stdout
+
+def run_networks(network_fn, networks, max_concurrency: int = MAX_CONCURRENCY) -> dict:
+    """Blocking wrapper around `run_networks_async`."""
+    return asyncio.run(run_networks_async(network_fn, networks, max_concurrency=max_concurrency))
+
+def run_pools(pool_fn, networks, pool_index: int | None = None, max_concurrency: int = MAX_CONCURRENCY) -> dict:
+    """Blocking wrapper around `run_pools_async`."""
+    return asyncio.run(run_pools_async(pool_fn, networks, pool_index=pool_index, max_concurrency=max_concurrency))
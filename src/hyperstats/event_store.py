@@ -0,0 +1,505 @@
+import json
+import os
+import sqlite3
+import time
+
+from hexbytes import HexBytes
+
+from hyperstats.constants import CONFIRMATION_DEPTH, EVENT_STORE_PATH
+from hyperstats.web3_utils import batch_request
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfer_single (
+    chain_id INTEGER NOT NULL,
+    pool TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    block_hash TEXT NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    operator TEXT NOT NULL,
+    from_address TEXT NOT NULL,
+    to_address TEXT NOT NULL,
+    asset_id TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (chain_id, pool, block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS transfer_single_operator ON transfer_single (chain_id, pool, operator);
+CREATE INDEX IF NOT EXISTS transfer_single_from ON transfer_single (chain_id, pool, from_address);
+CREATE INDEX IF NOT EXISTS transfer_single_to ON transfer_single (chain_id, pool, to_address);
+CREATE INDEX IF NOT EXISTS transfer_single_id ON transfer_single (chain_id, pool, asset_id);
+
+CREATE TABLE IF NOT EXISTS sync_cursor (
+    chain_id INTEGER NOT NULL,
+    pool TEXT NOT NULL,
+    stream TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, pool, stream)
+);
+
+CREATE TABLE IF NOT EXISTS sync_block_hash (
+    chain_id INTEGER NOT NULL,
+    pool TEXT NOT NULL,
+    stream TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    block_hash TEXT NOT NULL,
+    PRIMARY KEY (chain_id, pool, stream, block_number)
+);
+
+CREATE TABLE IF NOT EXISTS deployment (
+    chain_id INTEGER NOT NULL,
+    hyperdrive TEXT NOT NULL,
+    factory TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    extra_data TEXT NOT NULL,
+    PRIMARY KEY (chain_id, hyperdrive)
+);
+
+CREATE TABLE IF NOT EXISTS pool_metadata (
+    chain_id INTEGER NOT NULL,
+    pool TEXT NOT NULL,
+    deployment_block INTEGER NOT NULL,
+    extra_data TEXT,
+    PRIMARY KEY (chain_id, pool)
+);
+
+CREATE TABLE IF NOT EXISTS pool_immutables (
+    chain_id INTEGER NOT NULL,
+    pool TEXT NOT NULL,
+    code_hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    pool_config TEXT NOT NULL,
+    morpho_vault TEXT,
+    morpho_market_id TEXT,
+    symbol TEXT,
+    PRIMARY KEY (chain_id, pool)
+);
+
+CREATE TABLE IF NOT EXISTS pool_sample (
+    chain_id INTEGER NOT NULL,
+    pool TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    share_reserves TEXT NOT NULL,
+    share_adjustment TEXT NOT NULL,
+    bond_reserves TEXT NOT NULL,
+    vault_share_price TEXT NOT NULL,
+    shorts_outstanding TEXT NOT NULL,
+    vault_shares_balance TEXT NOT NULL,
+    PRIMARY KEY (chain_id, pool, block_number)
+);
+
+CREATE TABLE IF NOT EXISTS block_timestamp (
+    chain_id INTEGER NOT NULL,
+    block_number INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, block_number)
+);
+CREATE INDEX IF NOT EXISTS block_timestamp_timestamp ON block_timestamp (chain_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS erc20_transfer (
+    chain_id INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    from_address TEXT NOT NULL,
+    to_address TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (chain_id, token, block_number, log_index)
+);
+
+CREATE TABLE IF NOT EXISTS holder_checkpoint (
+    chain_id INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    holder TEXT NOT NULL,
+    balance TEXT NOT NULL,
+    PRIMARY KEY (chain_id, token, block_number, holder)
+);
+
+CREATE TABLE IF NOT EXISTS address_label (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at INTEGER,
+    PRIMARY KEY (chain_id, address, field)
+);
+
+CREATE TABLE IF NOT EXISTS holder_checkpoint_block (
+    chain_id INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, token, block_number)
+);
+"""
+
+# pool state kept per sampled block, stored as decimal text since some are signed
+SAMPLE_FIELDS = ("shareReserves", "shareAdjustment", "bondReserves", "vaultSharePrice", "shortsOutstanding", "vaultSharesBalance")
+
+def encode_uint256(value: int) -> str:
+    """Encode a uint256 as fixed-width hex, so text order in SQLite matches numeric order."""
+    return f"0x{value:064x}"
+
+def open_store(path: str = EVENT_STORE_PATH) -> sqlite3.Connection:
+    """Open the event store, creating the file and its tables if needed."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+def get_sync_cursor(conn, chain_id: int, pool: str, stream: str = "TransferSingle") -> int | None:
+    """Return the last block whose logs are fully stored for a pool, or None."""
+    row = conn.execute(
+        "SELECT block_number FROM sync_cursor WHERE chain_id = ? AND pool = ? AND stream = ?",
+        (chain_id, pool, stream),
+    ).fetchone()
+    return row[0] if row else None
+
+def set_sync_cursor(conn, chain_id: int, pool: str, block_number: int, stream: str = "TransferSingle") -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_cursor (chain_id, pool, stream, block_number) VALUES (?, ?, ?, ?)",
+        (chain_id, pool, stream, block_number),
+    )
+
+def get_pool_metadata(conn, chain_id: int, pool: str) -> tuple[int, HexBytes | None] | None:
+    """Return (deployment_block, extra_data) for a pool, or None if it is not stored."""
+    row = conn.execute(
+        "SELECT deployment_block, extra_data FROM pool_metadata WHERE chain_id = ? AND pool = ?",
+        (chain_id, pool),
+    ).fetchone()
+    if row is None:
+        return None
+    return row[0], HexBytes(row[1]) if row[1] is not None else None
+
+def set_pool_metadata(conn, chain_id: int, pool: str, deployment_block: int, extra_data) -> None:
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO pool_metadata (chain_id, pool, deployment_block, extra_data) VALUES (?, ?, ?, ?)",
+            (chain_id, pool, deployment_block, HexBytes(extra_data).to_0x_hex() if extra_data is not None else None),
+        )
+
+def get_immutables(conn, chain_id: int, pool: str, code_hash) -> dict | None:
+    """Return a pool's stored immutable values, or None if missing or stored for other code.
+
+    `pool_config` is the ABI encoded `getPoolConfig()` result, `morpho_market_id` is raw bytes.
+    """
+    row = conn.execute(
+        "SELECT name, pool_config, morpho_vault, morpho_market_id, symbol FROM pool_immutables"
+        " WHERE chain_id = ? AND pool = ? AND code_hash = ?",
+        (chain_id, pool, HexBytes(code_hash).to_0x_hex()),
+    ).fetchone()
+    if row is None:
+        return None
+    name, pool_config, morpho_vault, morpho_market_id, symbol = row
+    return {
+        "name": name,
+        "pool_config": HexBytes(pool_config),
+        "morpho_vault": morpho_vault,
+        "morpho_market_id": HexBytes(morpho_market_id) if morpho_market_id is not None else None,
+        "symbol": symbol,
+    }
+
+def set_immutables(conn, chain_id: int, pool: str, code_hash, immutables: dict) -> None:
+    """Store a pool's immutable values, replacing any stored for previous code."""
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO pool_immutables VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                chain_id,
+                pool,
+                HexBytes(code_hash).to_0x_hex(),
+                immutables["name"],
+                HexBytes(immutables["pool_config"]).to_0x_hex(),
+                immutables["morpho_vault"],
+                HexBytes(immutables["morpho_market_id"]).to_0x_hex() if immutables["morpho_market_id"] is not None else None,
+                immutables["symbol"],
+            ),
+        )
+
+def get_pool_samples(conn, chain_id: int, pool: str, block_numbers) -> dict[int, dict]:
+    """Return the stored samples of a pool at the given blocks, by block number."""
+    block_numbers = list(block_numbers)
+    samples = {}
+    # stay below SQLite's limit on the number of bound parameters
+    for chunk_start in range(0, len(block_numbers), 500):
+        chunk = block_numbers[chunk_start:chunk_start + 500]
+        rows = conn.execute(
+            "SELECT block_number, timestamp, share_reserves, share_adjustment, bond_reserves, vault_share_price, shorts_outstanding, vault_shares_balance"
+            f" FROM pool_sample WHERE chain_id = ? AND pool = ? AND block_number IN ({', '.join('?' * len(chunk))})",
+            (chain_id, pool, *chunk),
+        )
+        for block_number, timestamp, *values in rows:
+            samples[block_number] = {"blockNumber": block_number, "timestamp": timestamp, **{field: int(value) for field, value in zip(SAMPLE_FIELDS, values)}}
+    return samples
+
+def append_pool_samples(conn, chain_id: int, pool: str, samples) -> None:
+    """Store pool samples, which must only cover final blocks."""
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO pool_sample VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((chain_id, pool, sample["blockNumber"], sample["timestamp"], *(str(sample[field]) for field in SAMPLE_FIELDS)) for sample in samples),
+        )
+
+def get_block_timestamp_bracket(conn, chain_id: int, timestamp: int) -> tuple[tuple | None, tuple | None]:
+    """Return the stored (block_number, timestamp) pairs closest below and at or above `timestamp`.
+
+    Either side is None if no stored block falls on it.
+    """
+    below = conn.execute(
+        "SELECT block_number, timestamp FROM block_timestamp WHERE chain_id = ? AND timestamp < ? ORDER BY block_number DESC LIMIT 1",
+        (chain_id, timestamp),
+    ).fetchone()
+    above = conn.execute(
+        "SELECT block_number, timestamp FROM block_timestamp WHERE chain_id = ? AND timestamp >= ? ORDER BY block_number LIMIT 1",
+        (chain_id, timestamp),
+    ).fetchone()
+    return below, above
+
+def add_block_timestamps(conn, chain_id: int, block_timestamps) -> None:
+    """Store (block_number, timestamp) pairs, which must only cover final blocks."""
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO block_timestamp VALUES (?, ?, ?)",
+            ((chain_id, block_number, timestamp) for block_number, timestamp in block_timestamps),
+        )
+
+def append_transfers(conn, chain_id: int, pool: str, transfers, synced_block: int, synced_block_hash=None, confirmations: int = CONFIRMATION_DEPTH) -> None:
+    """Store decoded `TransferSingle` logs and advance the pool's cursor in one transaction.
+
+    The hash of the synced block is kept until it is `confirmations` blocks deep, so the
+    next sync can tell whether the unconfirmed tail was reorged.
+
+    Args:
+        conn: Event store connection
+        chain_id: Chain id of the pool's network
+        pool: Pool address
+        transfers: Decoded `TransferSingle` events
+        synced_block: Last block covered by `transfers`
+        synced_block_hash: Hash of `synced_block`
+        confirmations: Depth below the synced block at which blocks are final
+    """
+    with conn:
+        if synced_block_hash is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_block_hash VALUES (?, ?, 'TransferSingle', ?, ?)",
+                (chain_id, pool, synced_block, HexBytes(synced_block_hash).to_0x_hex()),
+            )
+            conn.execute(
+                "DELETE FROM sync_block_hash WHERE chain_id = ? AND pool = ? AND stream = 'TransferSingle' AND block_number < ?",
+                (chain_id, pool, synced_block - confirmations),
+            )
+        conn.executemany(
+            "INSERT OR IGNORE INTO transfer_single VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    chain_id,
+                    pool,
+                    transfer["blockNumber"],
+                    transfer["logIndex"],
+                    HexBytes(transfer["blockHash"]).to_0x_hex(),
+                    HexBytes(transfer["transactionHash"]).to_0x_hex(),
+                    transfer["args"]["operator"],
+                    transfer["args"]["from"],
+                    transfer["args"]["to"],
+                    encode_uint256(transfer["args"]["id"]),
+                    str(transfer["args"]["value"]),
+                )
+                for transfer in transfers
+            ),
+        )
+        set_sync_cursor(conn, chain_id, pool, synced_block)
+
+def iter_transfers(conn, chain_id: int, pool: str, to_block: int | None = None):
+    """Yield stored `TransferSingle` logs in block order, shaped like decoded events."""
+    query = (
+        "SELECT block_number, log_index, block_hash, transaction_hash, operator, from_address, to_address, asset_id, value"
+        " FROM transfer_single WHERE chain_id = ? AND pool = ?"
+    )
+    params = [chain_id, pool]
+    if to_block is not None:
+        query += " AND block_number <= ?"
+        params.append(to_block)
+    query += " ORDER BY block_number, log_index"
+    for block_number, log_index, block_hash, transaction_hash, operator, from_address, to_address, asset_id, value in conn.execute(query, params):
+        yield {
+            "blockNumber": block_number,
+            "logIndex": log_index,
+            "blockHash": block_hash,
+            "transactionHash": transaction_hash,
+            "args": {"operator": operator, "from": from_address, "to": to_address, "id": int(asset_id, 16), "value": int(value)},
+        }
+
+def get_participants(conn, chain_id: int, pool: str) -> tuple[set, set]:
+    """Return the set of recipients and the set of asset ids seen in a pool's transfers."""
+    users = {row[0] for row in conn.execute(
+        "SELECT DISTINCT to_address FROM transfer_single WHERE chain_id = ? AND pool = ?", (chain_id, pool)
+    )}
+    ids = {int(row[0], 16) for row in conn.execute(
+        "SELECT DISTINCT asset_id FROM transfer_single WHERE chain_id = ? AND pool = ?", (chain_id, pool)
+    )}
+    return users, ids
+
+def rewind(conn, chain_id: int, pool: str, block_number: int) -> None:
+    """Drop everything stored for a pool after `block_number` and move its cursor back there."""
+    with conn:
+        conn.execute("DELETE FROM transfer_single WHERE chain_id = ? AND pool = ? AND block_number > ?", (chain_id, pool, block_number))
+        conn.execute(
+            "DELETE FROM sync_block_hash WHERE chain_id = ? AND pool = ? AND stream = 'TransferSingle' AND block_number > ?",
+            (chain_id, pool, block_number),
+        )
+        set_sync_cursor(conn, chain_id, pool, block_number)
+
+def rewind_reorged_tail(w3, conn, chain_id: int, pool: str, confirmations: int = CONFIRMATION_DEPTH) -> int | None:
+    """Detect a reorg of a pool's unconfirmed tail and rewind just the affected blocks.
+
+    Blocks within `confirmations` of the cursor are provisional. Their stored hashes (synced
+    heads and blocks with logs) are compared with the chain in a single batch. The highest
+    block that still matches is the fork point, since its ancestors are canonical too. If no
+    tail block matches, the whole tail is dropped.
+
+    Returns:
+        int | None: The cursor after any rewind, or None if the pool was never synced
+    """
+    cursor = get_sync_cursor(conn, chain_id, pool)
+    if cursor is None:
+        return None
+    final_block = max(cursor - confirmations, 0)
+    stored_hashes = dict(conn.execute(
+        "SELECT block_number, block_hash FROM sync_block_hash WHERE chain_id = ? AND pool = ? AND stream = 'TransferSingle' AND block_number > ?",
+        (chain_id, pool, final_block),
+    ))
+    stored_hashes.update(conn.execute(
+        "SELECT DISTINCT block_number, block_hash FROM transfer_single WHERE chain_id = ? AND pool = ? AND block_number > ?",
+        (chain_id, pool, final_block),
+    ))
+    if not stored_hashes:
+        return cursor
+    tail_blocks = sorted(stored_hashes, reverse=True)
+    headers = batch_request(w3, [("eth_getBlockByNumber", [hex(block), False]) for block in tail_blocks])
+    fork_block = final_block
+    for block, header in zip(tail_blocks, headers):
+        if isinstance(header, Exception):
+            raise header
+        if header is not None and header["hash"].to_0x_hex() == stored_hashes[block]:
+            fork_block = max(block, fork_block)
+            break
+    if fork_block < cursor:
+        print(f"Reorg detected for pool {pool} after block {fork_block}, rewinding {cursor - fork_block} blocks.")
+        rewind(conn, chain_id, pool, fork_block)
+    return fork_block
+
+def append_deployments(conn, chain_id: int, factory: str, deployments, synced_block: int) -> None:
+    """Store decoded factory `Deployed` logs and advance the factory's cursor in one transaction."""
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO deployment VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    chain_id,
+                    deployment["args"]["hyperdrive"],
+                    factory,
+                    deployment["blockNumber"],
+                    HexBytes(deployment["transactionHash"]).to_0x_hex(),
+                    deployment["args"]["name"],
+                    HexBytes(deployment["args"]["extraData"]).to_0x_hex(),
+                )
+                for deployment in deployments
+            ),
+        )
+        set_sync_cursor(conn, chain_id, factory, synced_block, stream="Deployed")
+
+def get_deployment(conn, chain_id: int, hyperdrive: str) -> tuple[int, str, HexBytes] | None:
+    """Return (block_number, transaction_hash, raw extra_data) of an indexed deployment, or None."""
+    row = conn.execute(
+        "SELECT block_number, transaction_hash, extra_data FROM deployment WHERE chain_id = ? AND hyperdrive = ?",
+        (chain_id, hyperdrive),
+    ).fetchone()
+    if row is None:
+        return None
+    return row[0], row[1], HexBytes(row[2])
+
+def append_erc20_transfers(conn, chain_id: int, token: str, transfers) -> None:
+    """Store decoded ERC20 `Transfer` logs, which must only cover final blocks."""
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO erc20_transfer VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (chain_id, token, transfer["blockNumber"], transfer["logIndex"], transfer["args"]["from"], transfer["args"]["to"], str(transfer["args"]["value"]))
+                for transfer in transfers
+            ),
+        )
+
+def iter_erc20_transfers(conn, chain_id: int, token: str, from_block: int = 0, to_block: int | None = None, page_size: int = 10000):
+    """Yield stored ERC20 `Transfer` logs in pages, in block order, shaped like decoded events."""
+    query = (
+        "SELECT block_number, log_index, from_address, to_address, value"
+        " FROM erc20_transfer WHERE chain_id = ? AND token = ? AND block_number >= ?"
+    )
+    params = [chain_id, token, from_block]
+    if to_block is not None:
+        query += " AND block_number <= ?"
+        params.append(to_block)
+    query += " ORDER BY block_number, log_index"
+    rows = conn.execute(query, params)
+    while page := rows.fetchmany(page_size):
+        yield [
+            {"blockNumber": block_number, "logIndex": log_index, "args": {"from": from_address, "to": to_address, "value": int(value)}}
+            for block_number, log_index, from_address, to_address, value in page
+        ]
+
+def get_holder_checkpoint(conn, chain_id: int, token: str, block_number: int) -> tuple[int | None, dict]:
+    """Return the latest stored holder balances of a token at or before `block_number`.
+
+    Returns:
+        tuple: (checkpoint block, mapping of holder to balance), or (None, {}) if there is none
+    """
+    row = conn.execute(
+        "SELECT MAX(block_number) FROM holder_checkpoint_block WHERE chain_id = ? AND token = ? AND block_number <= ?",
+        (chain_id, token, block_number),
+    ).fetchone()
+    if row[0] is None:
+        return None, {}
+    balances = {
+        holder: int(balance) for holder, balance in conn.execute(
+            "SELECT holder, balance FROM holder_checkpoint WHERE chain_id = ? AND token = ? AND block_number = ?",
+            (chain_id, token, row[0]),
+        )
+    }
+    return row[0], balances
+
+def set_holder_checkpoint(conn, chain_id: int, token: str, block_number: int, balances) -> None:
+    """Store a token's positive holder balances as of `block_number`, which must be final."""
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO holder_checkpoint_block VALUES (?, ?, ?)", (chain_id, token, block_number))
+        conn.executemany(
+            "INSERT OR REPLACE INTO holder_checkpoint VALUES (?, ?, ?, ?, ?)",
+            ((chain_id, token, block_number, holder, str(balance)) for holder, balance in balances if balance > 0),
+        )
+
+def get_address_labels(conn, chain_id: int, address: str, fields) -> dict:
+    """Return the unexpired cached labels of an address, by field, decoded from JSON."""
+    fields = list(fields)
+    rows = conn.execute(
+        f"SELECT field, value FROM address_label WHERE chain_id = ? AND address = ? AND field IN ({', '.join('?' * len(fields))})"
+        " AND (expires_at IS NULL OR expires_at > ?)",
+        (chain_id, address, *fields, int(time.time())),
+    )
+    return {field: json.loads(value) for field, value in rows}
+
+def set_address_labels(conn, chain_id: int, address: str, labels: dict, ttls: dict) -> None:
+    """Cache labels of an address as JSON, each expiring after its field's TTL in seconds.
+
+    A TTL of None never expires.
+    """
+    now = int(time.time())
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO address_label VALUES (?, ?, ?, ?, ?)",
+            (
+                (chain_id, address, field, json.dumps(value), now + ttls[field] if ttls[field] is not None else None)
+                for field, value in labels.items()
+            ),
+        )
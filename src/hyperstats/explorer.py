@@ -0,0 +1,143 @@
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from lxml import html
+from requests.adapters import HTTPAdapter
+
+from hyperstats.constants import ADDRESS_LABEL_TTLS, CHAIN_IDS, EXPLORER_BURST, EXPLORER_RATE_LIMIT, EXPLORER_URLS, LABEL_CONCURRENCY
+from hyperstats.event_store import get_address_labels, open_store, set_address_labels
+
+# networks whose addresses each explorer tags, so cached tags are keyed by chain id
+EXPLORER_NETWORKS = {"etherscan": "mainnet", "basescan": "base"}
+# where Etherscan-family address pages show the public name tag
+TAG_XPATH = '/html/body/main/section[3]/div[1]/div[1]/a/div/span'
+# present on every real address page, but not on rate limit, captcha or error pages served with a 200
+ADDRESS_PAGE_XPATH = '//*[@id="mainaddress"]'
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per second, in bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take a token, sleeping until one is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ExplorerTagClient:
+    """Fetch public name tags of addresses from block explorer pages.
+
+    Requests share one keep-alive session, each explorer host has its own token bucket of
+    `rate` requests per second, and up to `max_workers` pages are fetched at once. With
+    `cache`, tags are kept as address labels in the event store, including the absence of a
+    tag, for their `ADDRESS_LABEL_TTLS`. Failed requests are not stored, but are not retried
+    by the same client either, so a struggling explorer is not asked twice per report.
+    """
+
+    def __init__(
+        self,
+        base_urls: dict | None = None,
+        rate: float = EXPLORER_RATE_LIMIT,
+        burst: int = EXPLORER_BURST,
+        max_workers: int = LABEL_CONCURRENCY["explorer"],
+        timeout: float = 5,
+        cache: bool = True,
+    ):
+        self.base_urls = {**EXPLORER_URLS, **(base_urls or {})}
+        self.rate = rate
+        self.burst = burst
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=len(self.base_urls), pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._failed = set()  # (explorer, address) whose request failed
+
+    def _bucket(self, host: str) -> TokenBucket:
+        with self._buckets_lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def fetch_tag(self, explorer: str, address: str, debug: bool = False) -> str | None:
+        """Scrape an address page, returning its tag, "" if it has none, or None if the request failed.
+
+        A 200 response is only trusted as an untagged address when it is a real address page.
+        """
+        url = f"{self.base_urls[explorer].rstrip('/')}/address/{address}"
+        self._bucket(urlsplit(url).netloc).acquire()
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as exc:
+            if debug:
+                print(f"{explorer} {exc=}")
+            return None
+        if debug:
+            print(f"{explorer} {response.status_code=}")
+        if response.status_code != 200:
+            return None
+        tree = html.fromstring(response.content)
+        if not tree.xpath(ADDRESS_PAGE_XPATH):
+            if debug:
+                print(f"{explorer} returned a page without an address for {address}")
+            return None
+        tag_elements = tree.xpath(TAG_XPATH)
+        return tag_elements[0].text_content().strip() if tag_elements else ""
+
+    def get_tags(self, explorer: str, addresses, debug: bool = False) -> list[str]:
+        """Return the tag of each address on an explorer, "" if it has none or the lookup failed."""
+        addresses = list(addresses)
+        chain_id = CHAIN_IDS[EXPLORER_NETWORKS[explorer]]
+        field = f"{explorer}_tag"
+        tags = {}
+        if self.cache:
+            conn = open_store()
+            for address in addresses:
+                labels = get_address_labels(conn, chain_id, address, (field,))
+                if field in labels:
+                    tags[address] = labels[field]
+            conn.close()
+        missing = list(dict.fromkeys(address for address in addresses if address not in tags and (explorer, address) not in self._failed))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            fetched = dict(zip(missing, executor.map(lambda address: self.fetch_tag(explorer, address, debug=debug), missing)))
+        if self.cache:
+            conn = open_store()
+            for address, tag in fetched.items():
+                if tag is not None:
+                    set_address_labels(conn, chain_id, address, {field: tag}, {field: ADDRESS_LABEL_TTLS["explorer_tag" if tag else "no_explorer_tag"]})
+            conn.close()
+        self._failed.update((explorer, address) for address, tag in fetched.items() if tag is None)
+        tags.update(fetched)
+        return [tags.get(address) or "" for address in addresses]
+
+    def get_tag(self, explorer: str, address: str, debug: bool = False) -> str:
+        """Return the tag of one address on an explorer, see `get_tags`."""
+        return self.get_tags(explorer, [address], debug=debug)[0]
+
+@functools.cache
+def get_explorer_client() -> ExplorerTagClient:
+    """Return the client shared by this process, created on first use."""
+    return ExplorerTagClient()
@@ -0,0 +1,151 @@
+import numpy as np
+
+ONE_18 = 10**18
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+
+# Fixed-point math ported from Hyperdrive's FixedPointMath library, whose `ln` and `exp`
+# come from solmate's `lnWad` and `expWad`. Values are integers scaled by 1e18 and every
+# step rounds the way the contract does, so results match `getPoolInfo`-based views exactly.
+
+def _sdiv(a: int, b: int) -> int:
+    """Signed division truncating toward zero, like Solidity's."""
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+def mul_div_down(x: int, y: int, d: int) -> int:
+    return x * y // d
+
+def mul_down(a: int, b: int) -> int:
+    return a * b // ONE_18
+
+def div_down(a: int, b: int) -> int:
+    return a * ONE_18 // b
+
+def ln(x: int) -> int:
+    """Natural logarithm of a positive 1e18 fixed-point number."""
+    if x <= 0:
+        raise ValueError(f"ln of non-positive value {x}")
+    # reduce the range of x to (1, 2) * 2**96, since ln(2**k * x) = k * ln(2) + ln(x)
+    k = x.bit_length() - 1 - 96
+    x = (x << (159 - k)) >> 159
+    # (8, 8)-term rational approximation, p is monic and left in 2**192 basis
+    p = x + 3273285459638523848632254066296
+    p = ((p * x) >> 96) + 24828157081833163892658089445524
+    p = ((p * x) >> 96) + 43456485725739037958740375743393
+    p = ((p * x) >> 96) - 11111509109440967052023855526967
+    p = ((p * x) >> 96) - 45023709667254063763336534515857
+    p = ((p * x) >> 96) - 14706773417378608786704636184526
+    p = p * x - (795164235651350426258249787498 << 96)
+    q = x + 5573035233440673466300451813936
+    q = ((q * x) >> 96) + 71694874799317883764090561454958
+    q = ((q * x) >> 96) + 283447036172924575727196451306956
+    q = ((q * x) >> 96) + 401686690394027663651624208769553
+    q = ((q * x) >> 96) + 204048457590392012362485061816622
+    q = ((q * x) >> 96) + 31853899698501571402653359427138
+    q = ((q * x) >> 96) + 909429971244387300277376558375
+    r = _sdiv(p, q)
+    # scale, add ln(2**96 / 1e18) and k * ln(2), then convert back to 1e18 basis
+    r *= 1677202110996718588342820967067443963516166
+    r += 16597577552685614221487285958193947469193820559219878177908093499208371 * k
+    r += 600920179829731861736702779321621459595472258049074101567377883020018308
+    return r >> 174
+
+def exp(x: int) -> int:
+    """Exponential of a 1e18 fixed-point number."""
+    # the result is below 0.5e-18 and rounds to zero
+    if x <= -42139678854452767551:
+        return 0
+    if x >= 135305999368893231589:
+        raise ValueError(f"exp of {x} overflows")
+    # convert to 2**96 basis, then reduce to (-ln(2) / 2, ln(2) / 2) * 2**96 by factoring out 2**k
+    x = _sdiv(x << 78, 5**18)
+    k = (_sdiv(x << 96, 54916777467707473351141471128) + 2**95) >> 96
+    x = x - k * 54916777467707473351141471128
+    # (6, 7)-term rational approximation, p is monic and left in 2**192 basis
+    y = x + 1346386616545796478920950773328
+    y = ((y * x) >> 96) + 57155421227552351082224309758442
+    p = y + x - 94201549194550492254356042504812
+    p = ((p * y) >> 96) + 28719021644029726153956944680412240
+    p = p * x + (4385272521454847904659076985693276 << 96)
+    q = x - 2855989394907223263936484059900
+    q = ((q * x) >> 96) + 50020603652535783019961831881945
+    q = ((q * x) >> 96) - 533845033583426703283633433725380
+    q = ((q * x) >> 96) + 3604857256930695427073651918091429
+    q = ((q * x) >> 96) - 14423608567350463180887372962807573
+    q = ((q * x) >> 96) + 26449188498355588339934803723976023
+    r = _sdiv(p, q)
+    # multiply by the scale factor, 2**k and 1e18 / 2**96 at once
+    return (r * 3822833074963236453042738258902158003155416615667) >> (195 - k)
+
+def pow_fixed(x: int, y: int) -> int:
+    """Raise a 1e18 fixed-point number to a 1e18 fixed-point power, as exp(y * ln(x))."""
+    if y == 0:
+        return ONE_18
+    if x == 0:
+        return 0
+    return exp(_sdiv(y * ln(x), ONE_18))
+
+def calculate_spot_price_fixed(effective_share_reserves: int, bond_reserves: int, initial_vault_share_price: int, time_stretch: int) -> int:
+    """Spot price as `HyperdriveMath.calculateSpotPrice` computes it, in 1e18 fixed point."""
+    if effective_share_reserves < 0:
+        raise ValueError(f"negative effective share reserves {effective_share_reserves}")
+    return pow_fixed(mul_div_down(initial_vault_share_price, effective_share_reserves, bond_reserves), time_stretch)
+
+def calculate_apr_from_price_fixed(price: int, duration: int) -> int:
+    """APR as `HyperdriveMath.calculateAPRFromPrice` computes it, in 1e18 fixed point."""
+    return div_down(ONE_18 - price, mul_down(price, div_down(duration, SECONDS_PER_YEAR)))
+
+_spot_prices_fixed = np.frompyfunc(calculate_spot_price_fixed, 4, 1)
+_aprs_from_prices_fixed = np.frompyfunc(calculate_apr_from_price_fixed, 2, 1)
+
+def _as_array(values, exact: bool) -> np.ndarray:
+    # uint256 values overflow int64, so the exact mode keeps Python ints in object arrays
+    return np.asarray(values, dtype=object if exact else np.float64)
+
+def calculate_spot_prices(effective_share_reserves, bond_reserves, initial_vault_share_price, time_stretch, exact: bool = False) -> np.ndarray:
+    """Vectorized `calculate_spot_price` over arrays of raw 1e18 fixed-point pool values.
+
+    Arguments broadcast against each other, so config values can be scalars.
+
+    Returns:
+        np.ndarray: Float prices, or with `exact` the contract's 1e18 fixed-point prices as ints
+    """
+    if exact:
+        return _spot_prices_fixed(
+            _as_array(effective_share_reserves, exact),
+            _as_array(bond_reserves, exact),
+            _as_array(initial_vault_share_price, exact),
+            _as_array(time_stretch, exact),
+        )
+    ratio = _as_array(initial_vault_share_price, exact) / 1e18 * _as_array(effective_share_reserves, exact) / _as_array(bond_reserves, exact)
+    return np.power(ratio, _as_array(time_stretch, exact) / 1e18)
+
+def calculate_aprs_from_prices(prices, durations, exact: bool = False) -> np.ndarray:
+    """Vectorized `calculate_apr_from_price`, with prices in the form `calculate_spot_prices` returns."""
+    if exact:
+        return _aprs_from_prices_fixed(_as_array(prices, exact), _as_array(durations, exact))
+    t = _as_array(durations, exact) / SECONDS_PER_YEAR
+    prices = _as_array(prices, exact)
+    return (1 - prices) / (prices * t)
+
+def calc_aprs(columns: dict, exact: bool = False) -> np.ndarray:
+    """Vectorized `calc_apr` over columns of pool states.
+
+    Args:
+        columns: Arrays or scalars keyed shareReserves, shareAdjustment, bondReserves,
+            initialVaultSharePrice, timeStretch and positionDuration
+        exact: Use the contract's fixed-point math instead of floats
+
+    Returns:
+        np.ndarray: Float APRs, or with `exact` the contract's 1e18 fixed-point APRs as ints
+    """
+    # subtract as ints, the difference of two large reserves loses precision in floats
+    effective_share_reserves = _as_array(_as_array(columns['shareReserves'], exact=True) - _as_array(columns['shareAdjustment'], exact=True), exact=True)
+    spot_prices = calculate_spot_prices(
+        effective_share_reserves if exact else effective_share_reserves.astype(np.float64),
+        columns['bondReserves'],
+        columns['initialVaultSharePrice'],
+        columns['timeStretch'],
+        exact=exact,
+    )
+    return calculate_aprs_from_prices(spot_prices, columns['positionDuration'], exact=exact)
@@ -0,0 +1,113 @@
+import re
+import weakref
+
+from eth_utils import get_abi_output_types
+from web3._utils.abi import map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+
+from hyperstats.constants import MULTICALL3_ABI, MULTICALL3_ADDRESS, MULTICALL_BATCH_SIZE
+
+# errors that mean the batch was too big for the node, rather than a bad call
+BATCH_LIMIT_ERRORS = re.compile(r"gas|size|too large|exceed|limit|timeout|timed out|413", re.IGNORECASE)
+
+_has_multicall3 = weakref.WeakKeyDictionary()
+
+def get_multicall_contract(w3):
+    return w3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+
+def has_multicall3(w3) -> bool:
+    """Check once per Web3 instance whether Multicall3 is deployed on its network."""
+    if w3 not in _has_multicall3:
+        _has_multicall3[w3] = len(w3.eth.get_code(MULTICALL3_ADDRESS)) > 0
+    return _has_multicall3[w3]
+
+def pin_block(w3, block_identifier=None) -> int:
+    """Resolve a block identifier to a block number, so several batches read the same state."""
+    if block_identifier is None or block_identifier == "latest":
+        return w3.eth.get_block_number()
+    if isinstance(block_identifier, str):
+        return w3.eth.get_block(block_identifier)["number"]
+    return block_identifier
+
+def eth_balance(w3, address):
+    """Return a call reading the ETH balance of an address, for use in `multicall`.
+
+    Without Multicall3 on the network, `multicall` reads the balance with eth_getBalance instead.
+    """
+    return get_multicall_contract(w3).functions.getEthBalance(address)
+
+def decode_call_result(w3, contract_function, return_data: bytes):
+    """Decode raw return data the same way `ContractFunction.call()` does."""
+    output_types = get_abi_output_types(contract_function.abi)
+    output_data = w3.codec.decode(output_types, return_data)
+    normalized_data = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, output_data)
+    if len(normalized_data) == 1:
+        return normalized_data[0]
+    return normalized_data
+
+def _aggregate(w3, calls, block_identifier) -> list:
+    """Run one `aggregate3` eth_call, bisecting the batch if the node rejects its size."""
+    multicall_contract = get_multicall_contract(w3)
+    try:
+        return multicall_contract.functions.aggregate3(
+            [(call.address, True, call._encode_transaction_data()) for call in calls]  # pylint: disable=protected-access
+        ).call(block_identifier=block_identifier)
+    except Exception as e:
+        if len(calls) == 1 or not BATCH_LIMIT_ERRORS.search(str(e)):
+            raise
+        mid = len(calls) // 2
+        print(f"multicall batch of {len(calls)} rejected ({e})\n => splitting into {mid} and {len(calls) - mid}")
+        return _aggregate(w3, calls[:mid], block_identifier) + _aggregate(w3, calls[mid:], block_identifier)
+
+def multicall(w3, calls, block_identifier=None, allow_failure: bool | list[bool] = False, batch_size: int = MULTICALL_BATCH_SIZE) -> list:
+    """Execute many contract reads in as few `aggregate3` eth_calls as possible.
+
+    Calls are packed `batch_size` at a time and pinned to a single block. Batches that hit
+    the node's gas or response-size limit are split in half until they fit. On networks
+    without Multicall3 the calls are made one by one instead.
+
+    Args:
+        w3: Web3 instance
+        calls: Bound contract functions, e.g. `contract.functions.balanceOf(id, user)`
+        block_identifier: Block to read at, defaults to the latest block
+        allow_failure: Return None for reverted calls instead of raising, either for all calls or per call
+        batch_size: Maximum number of calls per eth_call
+
+    Returns:
+        list: Decoded results, in the same order as `calls`
+    """
+    calls = list(calls)
+    if not calls:
+        return []
+    if isinstance(allow_failure, bool):
+        allow_failure = [allow_failure] * len(calls)
+    block_identifier = pin_block(w3, block_identifier)
+    results = []
+    if not has_multicall3(w3):
+        for call, may_fail in zip(calls, allow_failure):
+            try:
+                if call.address == MULTICALL3_ADDRESS and call.fn_name == "getEthBalance":
+                    # eth_balance calls target Multicall3 itself, so read the balance directly
+                    results.append(w3.eth.get_balance(call.args[0], block_identifier))
+                else:
+                    results.append(call.call(block_identifier=block_identifier))
+            except Exception:
+                if not may_fail:
+                    raise
+                results.append(None)
+        return results
+
+    for batch_start in range(0, len(calls), batch_size):
+        batch = calls[batch_start:batch_start + batch_size]
+        for call, may_fail, (success, return_data) in zip(batch, allow_failure[batch_start:], _aggregate(w3, batch, block_identifier)):
+            if success:
+                try:
+                    results.append(decode_call_result(w3, call, return_data))
+                    continue
+                except Exception:
+                    if not may_fail:
+                        raise
+            elif not may_fail:
+                raise ValueError(f"multicall: {call} on {call.address} reverted at block {block_identifier}")
+            results.append(None)
+    return results
@@ -1,16 +1,37 @@
 # %%
+import heapq
+import itertools
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
 
-import requests
-from lxml import html
-
-from hyperstats.constants import ERC20_ABI, SAFE_ABI, ZERO_ADDRESS
+from hyperstats.constants import ADDRESS_LABEL_TTLS, CONFIRMATION_DEPTH, ERC20_ABI, HOLDER_CHECKPOINT_INTERVAL, HOLDERS_TOP_N, LABEL_CONCURRENCY, SAFE_ABI, ZERO_ADDRESS
+from hyperstats.event_store import (
+    append_erc20_transfers,
+    get_address_labels,
+    get_holder_checkpoint,
+    get_sync_cursor,
+    iter_erc20_transfers,
+    open_store,
+    set_address_labels,
+    set_holder_checkpoint,
+    set_sync_cursor,
+)
+from hyperstats.explorer import get_explorer_client
+from hyperstats.multicall import decode_call_result, multicall
 from hyperstats.utils import get_first_contract_block
-from hyperstats.web3_utils import create_w3, fetch_events_logs_with_retry, get_bns_name
+from hyperstats.web3_utils import batch_request, call_request, create_w3, get_bns_names, get_chain_id, get_ens_names, iter_events_logs
 
 # pylint: disable=bare-except
 
+# code patterns of Safes: the masterCopy() getter of SafeProxy, and getOwners() with getThreshold()
+SAFE_PROXY_SELECTOR = bytes.fromhex("a619486e")
+SAFE_GETTER_SELECTORS = (bytes.fromhex("a0e67e2b"), bytes.fromhex("e75235b8"))
+# runtime code shorter than this is treated as a proxy, whose slot 0 may hold a Safe singleton
+SHORT_PROXY_CODE_SIZE = 256
+
 # %%
 def format_balance(balance: int, decimals: int) -> str:
     """Format balance with proper decimals."""
@@ -21,35 +42,215 @@ def check_contract(w3, address):
     code = w3.eth.get_code(address)
     return len(code) > 0
 
-def check_safe(w3, address, debug=False):
-    """Check if address is a Safe by looking for characteristic Safe functions."""
+def check_safe(w3, address, debug=False, cache=True):
+    """Check if address is a Safe by looking for characteristic Safe functions.
+
+    The code lookup and the three Safe getters go out as a single JSON-RPC batch.
+    Calls that revert or return nothing mean the address is not a Safe. With `cache`,
+    results are kept as address labels that expire after their `ADDRESS_LABEL_TTLS`,
+    so a known address costs no calls until then. Being a contract never expires.
+    """
     is_contract = is_safe = version = owners = threshold = None
 
     if debug:
         print(f"\nChecking if {address} is a Safe:")
 
-    is_contract = check_contract(w3, address)
+    if cache:
+        chain_id = get_chain_id(w3)
+        conn = open_store()
+        cached = _get_cached_safe(conn, chain_id, address)
+        conn.close()
+        if cached is not None:
+            return cached
+
+    safe = w3.eth.contract(address=address, abi=SAFE_ABI)
+    safe_calls = [safe.functions.VERSION(), safe.functions.getOwners(), safe.functions.getThreshold()]
+    code, *safe_results = batch_request(w3, [("eth_getCode", [address, "latest"])] + [call_request(call) for call in safe_calls])
+    if isinstance(code, Exception):
+        raise code
+    is_contract = len(code) > 0
     if debug:
         print(f"Is {'not ' if not is_contract else ' '}a contract: {is_contract}")
 
     if is_contract:
         # Check for Safe-specific functions
-        safe = w3.eth.contract(address=address, abi=SAFE_ABI)
         try:
-            # Try to call Safe-specific functions
-            version = safe.functions.VERSION().call()
-            owners = safe.functions.getOwners().call()
-            threshold = safe.functions.getThreshold().call()
+            version, owners, threshold = (
+                decode_call_result(w3, call, result) if not isinstance(result, Exception) else result
+                for call, result in zip(safe_calls, safe_results)
+            )
+            for result in (version, owners, threshold):
+                if isinstance(result, Exception):
+                    raise result
             if debug:
                 print("Is a Safe.")
             is_safe = True
 
         except Exception as exc:
+            version = owners = threshold = None
             if debug:
                 print(f"Not a Safe: {exc}")
+
+    if cache:
+        conn = open_store()
+        _set_cached_safe(conn, chain_id, address, (is_safe, version, owners, threshold, is_contract))
+        conn.close()
     return is_safe, version, owners, threshold, is_contract
 
-def get_transfer_logs(w3, contract_address):
+def _get_cached_safe(conn, chain_id: int, address) -> tuple | None:
+    """Return the cached `check_safe` result of an address, or None if any part of it expired."""
+    labels = get_address_labels(conn, chain_id, address, ("is_contract", "safe", "owners"))
+    if labels.get("is_contract") is False:
+        return None, None, None, None, False
+    # owners are only needed for Safes
+    if labels.get("is_contract") and "safe" in labels and (not labels["safe"][0] or "owners" in labels):
+        is_safe, version = labels["safe"]
+        owners, threshold = labels.get("owners", (None, None))
+        return is_safe, version, owners, threshold, True
+    return None
+
+def _set_cached_safe(conn, chain_id: int, address, result: tuple) -> None:
+    """Cache a `check_safe` result of an address, each part for its own TTL."""
+    is_safe, version, owners, threshold, is_contract = result
+    labels = {"is_contract": is_contract}
+    ttls = {"is_contract": ADDRESS_LABEL_TTLS["contract" if is_contract else "not_contract"]}
+    if is_contract:
+        labels["safe"] = [is_safe, version]
+        ttls["safe"] = ADDRESS_LABEL_TTLS["safe"]
+    if is_safe:
+        labels["owners"] = [owners, threshold]
+        ttls["owners"] = ADDRESS_LABEL_TTLS["owners"]
+    set_address_labels(conn, chain_id, address, labels, ttls)
+
+def _classify_safe_code(addresses, codes) -> dict:
+    """Sort addresses by their code into "eoa", "contract", Safe "candidate" or "unrecognized" short proxy."""
+    kinds = {}
+    for address, code in zip(addresses, codes):
+        if isinstance(code, Exception):
+            raise code
+        if len(code) == 0:
+            kinds[address] = "eoa"
+        elif SAFE_PROXY_SELECTOR in code or all(selector in code for selector in SAFE_GETTER_SELECTORS):
+            kinds[address] = "candidate"
+        elif len(code) < SHORT_PROXY_CODE_SIZE:
+            kinds[address] = "unrecognized"
+        else:
+            kinds[address] = "contract"
+    return kinds
+
+def _probe_singleton_slots(w3, addresses) -> set:
+    """Return the addresses whose storage slot 0, where Safe proxies keep their singleton, holds an address."""
+    slots = batch_request(w3, [("eth_getStorageAt", [address, "0x0", "latest"]) for address in addresses])
+    proxies = set()
+    for address, slot in zip(addresses, slots):
+        if isinstance(slot, Exception):
+            raise slot
+        singleton = int.from_bytes(slot, "big")
+        if 0 < singleton < 2**160:
+            proxies.add(address)
+    return proxies
+
+def check_safes(w3, addresses, debug=False, cache=True) -> list[tuple]:
+    """Classify many addresses as EOAs, contracts or Safes in a few round-trips.
+
+    All code is fetched in one JSON-RPC batch. Only contracts that look like Safes are
+    probed: proxies whose code embeds the `masterCopy()` selector, contracts with both the
+    `getOwners()` and `getThreshold()` selectors, and short unrecognized proxies whose
+    storage slot 0, where Safe proxies keep their singleton, holds an address. Slot 0 of
+    those is read in a second batch. `VERSION()`, `getOwners()` and `getThreshold()` are
+    then read for every candidate in one multicall, and a candidate is a Safe if all three
+    succeed. With `cache`, known addresses are skipped and results are cached like
+    `check_safe` does.
+
+    Returns:
+        list[tuple]: One `check_safe` result per address, in the same order
+    """
+    addresses = list(addresses)
+    results = {}
+    chain_id = get_chain_id(w3) if cache else None
+    if cache:
+        conn = open_store()
+        for address in addresses:
+            cached = _get_cached_safe(conn, chain_id, address)
+            if cached is not None:
+                results[address] = cached
+        conn.close()
+    missing = list(dict.fromkeys(address for address in addresses if address not in results))
+
+    codes = batch_request(w3, [("eth_getCode", [address, "latest"]) for address in missing])
+    contract_kinds = _classify_safe_code(missing, codes)
+    for address, kind in contract_kinds.items():
+        if kind in ("eoa", "contract"):
+            results[address] = (None, None, None, None, kind == "contract")
+    candidates = [address for address, kind in contract_kinds.items() if kind == "candidate"]
+    unrecognized = [address for address, kind in contract_kinds.items() if kind == "unrecognized"]
+    proxies = _probe_singleton_slots(w3, unrecognized)
+    for address in unrecognized:
+        if address in proxies:
+            candidates.append(address)
+        else:
+            results[address] = (None, None, None, None, True)
+
+    calls = []
+    for address in candidates:
+        safe = w3.eth.contract(address=address, abi=SAFE_ABI)
+        calls.extend([safe.functions.VERSION(), safe.functions.getOwners(), safe.functions.getThreshold()])
+    values = multicall(w3, calls, allow_failure=True)
+    for idx, address in enumerate(candidates):
+        version, owners, threshold = values[3 * idx:3 * idx + 3]
+        if version is None or owners is None or threshold is None:
+            results[address] = (None, None, None, None, True)
+        else:
+            results[address] = (True, version, owners, threshold, True)
+    if debug:
+        print(f"Classified {len(missing)} addresses: {len(candidates)} Safe candidates, {sum(1 for address in missing if results[address][0])} Safes")
+
+    if cache:
+        conn = open_store()
+        for address in missing:
+            _set_cached_safe(conn, chain_id, address, results[address])
+        conn.close()
+    return [results[address] for address in addresses]
+
+class HolderBalances:
+    """Running balances of a token's holders, folded from Transfer logs.
+
+    Each address is interned to an integer id on first sight, and balances live in a list
+    indexed by id, so memory grows with the number of holders and not with the number of
+    transfers. The zero address is id 0, whose balance is never read.
+    """
+
+    def __init__(self, balances=()):
+        self.address_ids = {ZERO_ADDRESS: 0}
+        self.addresses = [ZERO_ADDRESS]
+        self.balances = [0]
+        self.transfer_count = 0
+        for address, balance in balances:
+            self.balances[self._intern(address)] += balance
+
+    def _intern(self, address) -> int:
+        address_id = self.address_ids.get(address)
+        if address_id is None:
+            address_id = self.address_ids[address] = len(self.addresses)
+            self.addresses.append(address)
+            self.balances.append(0)
+        return address_id
+
+    def apply(self, transfer) -> None:
+        """Move the value of one Transfer log."""
+        value = transfer["args"]["value"]
+        self.balances[self._intern(transfer["args"]["from"])] -= value
+        self.balances[self._intern(transfer["args"]["to"])] += value
+        self.transfer_count += 1
+
+    def items(self):
+        """Yield (address, balance) for every current holder, in order of first appearance."""
+        for address_id in range(1, len(self.balances)):
+            if self.balances[address_id] > 0:
+                yield self.addresses[address_id], self.balances[address_id]
+
+def resolve_token(w3, contract_address):
+    """Return the ERC20 contract to track for an address, which is a pool's LP token if it has one."""
     # sanitize address
     contract_address = w3.to_checksum_address(contract_address)
 
@@ -68,186 +269,367 @@ def get_transfer_logs(w3, contract_address):
     except:
         address_of_interest = contract_address
 
-    # get deploy block
-    deploy_block, _ = get_first_contract_block(w3, address_of_interest)
-    print(f"Deploy block: {deploy_block}")
-
-    # create LP token contract
-    contract_of_interest = w3.eth.contract(address=address_of_interest, abi=ERC20_ABI)
-
-    # Track transfer events
-    transfer_logs = fetch_events_logs_with_retry(
+    return w3.eth.contract(address=address_of_interest, abi=ERC20_ABI)
+
+def sync_transfer_history(w3, contract_of_interest, confirmations: int = CONFIRMATION_DEPTH, checkpoint_interval: int = HOLDER_CHECKPOINT_INTERVAL) -> int:
+    """Bring a token's stored Transfer history and holder checkpoints up to the last final block.
+
+    Only blocks after the token's sync cursor are fetched, so a run after a previous one is a
+    small incremental fetch. Holder balances are checkpointed every `checkpoint_interval`
+    blocks and at the synced block. Blocks less than `confirmations` deep are never stored,
+    so stored history cannot be reorged.
+
+    Returns:
+        int: The last block whose Transfer logs are stored
+    """
+    token = contract_of_interest.address
+    conn = open_store()
+    chain_id = get_chain_id(w3)
+    final_block = w3.eth.get_block_number() - confirmations
+    cursor = get_sync_cursor(conn, chain_id, token, stream="Transfer")
+    if cursor is None:
+        deploy_block, _ = get_first_contract_block(w3, token)
+        print(f"Deploy block: {deploy_block}")
+        cursor = deploy_block - 1
+    if cursor >= final_block:
+        conn.close()
+        return cursor
+
+    # resume from the balances at the cursor
+    checkpoint_block, balances = get_holder_checkpoint(conn, chain_id, token, cursor)
+    holder_balances = HolderBalances(balances.items())
+    for page in iter_erc20_transfers(conn, chain_id, token, from_block=(checkpoint_block or 0) + 1, to_block=cursor):
+        for transfer in page:
+            holder_balances.apply(transfer)
+
+    next_checkpoint = -(-(cursor + 1) // checkpoint_interval) * checkpoint_interval
+    fetched_count = 0
+    transfer_pages = iter_events_logs(
         contract_event=contract_of_interest.events.Transfer(),
-        from_block=deploy_block,
+        from_block=cursor + 1,
+        to_block=final_block,
+        label=f"Transfer history {token}",
     )
-
-    # Print latest block and date
-    latest_block = w3.eth.get_block(transfer_logs[-1].blockNumber)
-    formatted_timestamp = datetime.fromtimestamp(latest_block.timestamp).strftime('%Y-%m-%d %H:%M:%S')
-
-    print(f"Latest block: {latest_block.number} ({formatted_timestamp})")
-
-    assert transfer_logs is not None, "error: transfer_logs is None"
-    print(f"Found {len(transfer_logs)} Transfer events")
-
-    return transfer_logs, contract_of_interest
-
-def get_holder_stats(transfer_logs, contract_of_interest):
-    # Track balances
-    balances = {}
-    # Process all transfers
-    for log in transfer_logs:
-        from_addr = log.args['from']
-        to_addr = log.args.to
-        value = log.args.value
-
-        # Subtract from sender
-        if from_addr != ZERO_ADDRESS:
-            balances[from_addr] = balances.get(from_addr, 0) - value
-
-        # Add to receiver
-        if to_addr != ZERO_ADDRESS:
-            balances[to_addr] = balances.get(to_addr, 0) + value
+    for page in transfer_pages:
+        for transfer in page:
+            # balances hold every log up to the checkpoint once a later block shows up
+            if transfer["blockNumber"] > next_checkpoint:
+                set_holder_checkpoint(conn, chain_id, token, next_checkpoint, holder_balances.items())
+                next_checkpoint = -(-transfer["blockNumber"] // checkpoint_interval) * checkpoint_interval
+            holder_balances.apply(transfer)
+        append_erc20_transfers(conn, chain_id, token, page)
+        fetched_count += len(page)
+    set_holder_checkpoint(conn, chain_id, token, final_block, holder_balances.items())
+    with conn:
+        set_sync_cursor(conn, chain_id, token, final_block, stream="Transfer")
+    print(f"Synced {fetched_count} Transfer events up to block {final_block}")
+    conn.close()
+    return final_block
+
+def _iter_stored_transfers(chain_id: int, token: str, from_block: int, to_block: int):
+    conn = open_store()
+    try:
+        yield from iter_erc20_transfers(conn, chain_id, token, from_block=from_block, to_block=to_block)
+    finally:
+        conn.close()
+
+def get_transfer_logs(w3, contract_address, block_number: int | None = None, cache: bool = True):
+    """Resolve the token to track and stream the Transfer logs needed for its holders at a block.
+
+    With `cache`, the stored history is synced first (see `sync_transfer_history`), and the
+    holders at `block_number` start from the nearest checkpoint at or before it, so only the
+    stored logs after the checkpoint and any unconfirmed blocks are streamed. Without it,
+    every log since deployment is fetched. Logs are streamed page by page.
+
+    Args:
+        w3: Web3 instance
+        contract_address: Token or pool address
+        block_number: Block to get holders at, defaults to latest
+        cache: Use the stored Transfer history and holder checkpoints
+
+    Returns:
+        tuple: (iterator of Transfer log pages, token contract, starting (holder, balance) pairs)
+    """
+    contract_of_interest = resolve_token(w3, contract_address)
+    token = contract_of_interest.address
+
+    # Print target block and date, and stop streaming there
+    target_block = w3.eth.get_block(block_number if block_number is not None else "latest")
+    formatted_timestamp = datetime.fromtimestamp(target_block.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    print(f"Latest block: {target_block.number} ({formatted_timestamp})")
+
+    def fetch(from_block):
+        return iter_events_logs(
+            contract_event=contract_of_interest.events.Transfer(),
+            from_block=from_block,
+            to_block=target_block.number,
+        )
+
+    if not cache:
+        deploy_block, _ = get_first_contract_block(w3, token)
+        print(f"Deploy block: {deploy_block}")
+        return fetch(deploy_block), contract_of_interest, {}
+
+    synced_block = sync_transfer_history(w3, contract_of_interest)
+    chain_id = get_chain_id(w3)
+    conn = open_store()
+    checkpoint_block, start_balances = get_holder_checkpoint(conn, chain_id, token, target_block.number)
+    conn.close()
+    transfer_pages = _iter_stored_transfers(chain_id, token, (checkpoint_block if checkpoint_block is not None else -1) + 1, min(target_block.number, synced_block))
+    if target_block.number > synced_block:
+        transfer_pages = itertools.chain(transfer_pages, fetch(synced_block + 1))
+    return transfer_pages, contract_of_interest, start_balances
+
+def get_holder_stats(transfer_pages, contract_of_interest, top_n: int | None = None, start_balances: dict | None = None):
+    """Fold Transfer log pages into current holder balances, one page at a time.
+
+    Memory grows with the number of holders and not with the number of transfers (see
+    `HolderBalances`). Only the `top_n` largest holders are selected, with a heap.
+
+    Args:
+        transfer_pages: Iterable of Transfer log pages, in block order
+        contract_of_interest: Token contract, used for its decimals
+        top_n: Number of largest holders to return, defaults to all
+        start_balances: Holder balances before the first page, e.g. from a checkpoint
+
+    Returns:
+        tuple: (holders as (address, balance) by descending balance, total supply, decimals)
+    """
+    holder_balances = HolderBalances((start_balances or {}).items())
+
+    # Process transfers as each page arrives
+    for page in transfer_pages:
+        for transfer in page:
+            holder_balances.apply(transfer)
+    print(f"Found {holder_balances.transfer_count} Transfer events")
 
     # Filter out zero balances
-    current_holders = {addr: balance for addr, balance in balances.items() if balance > 0}
+    current_holders = list(holder_balances.items())
 
     # Get token decimals
     decimals = contract_of_interest.functions.decimals().call()
 
     print(f"\nTotal current holders: {len(current_holders)}")
     # Calculate total supply for percentage
-    total_supply = sum(current_holders.values())
+    total_supply = sum(balance for _, balance in current_holders)
 
-    # Sort holders by balance
-    holders = sorted(current_holders.items(), key=lambda x: x[1], reverse=True)
+    # Select the largest holders by balance, ties in order of first appearance
+    if top_n is None:
+        holders = sorted(current_holders, key=lambda x: x[1], reverse=True)
+    else:
+        holders = heapq.nlargest(top_n, current_holders, key=lambda x: x[1])
 
     return holders, total_supply, decimals
 
-def get_ens_name(w3, address):
+def get_cached_labels(w3, addresses, field: str, resolve, cache: bool = True) -> list[str]:
+    """Return a name label of each address, resolving only those not cached or expired.
+
+    Names, including the lack of one, are cached for their field's `ADDRESS_LABEL_TTLS`.
+    Missing names are resolved together in a single call to `resolve`. If it fails, the
+    error is printed and they get empty names without being cached.
+
+    Args:
+        w3: Web3 instance of the network the names live on
+        addresses: Addresses to label
+        field: Label field, e.g. "ens_name"
+        resolve: Function of (w3, addresses) returning a name or an empty string per address
+        cache: Read and store the labels in the event store
+    """
+    addresses = list(addresses)
+    names = {}
+    if cache:
+        chain_id = get_chain_id(w3)
+        conn = open_store()
+        for address in addresses:
+            labels = get_address_labels(conn, chain_id, address, (field,))
+            if field in labels:
+                names[address] = labels[field]
+        conn.close()
+    missing = list(dict.fromkeys(address for address in addresses if address not in names))
+    if missing:
+        try:
+            resolved = resolve(w3, missing)
+        except Exception as error:
+            print(f"Error in {field} lookup: {error}")
+            return [names.get(address, "") for address in addresses]
+        names.update(zip(missing, resolved))
+        if cache:
+            conn = open_store()
+            for address in missing:
+                set_address_labels(conn, chain_id, address, {field: names[address]}, {field: ADDRESS_LABEL_TTLS[field]})
+            conn.close()
+    return [names[address] for address in addresses]
+
+def get_cached_label(w3, address, field: str, resolve, cache: bool = True) -> str:
+    """Return a name label of one address, see `get_cached_labels`."""
+    return get_cached_labels(w3, [address], field, resolve, cache=cache)[0]
+
+def get_ens_name(w3, address, cache=True):
     """Try to resolve ENS name for an address."""
-    try:
-        name = w3.ens.name(address)
-        if name:
-            return " " + ','.join(name) if isinstance(name, list) else name
-    except Exception:
-        pass
-    return ""
-
-def get_name(w3, address):
+    return get_cached_label(w3, address, "ens_name", get_ens_names, cache=cache)
+
+def limited(semaphores, backend, fn, *args, **kwargs):
+    """Call `fn` holding the backend's semaphore, if `semaphores` limits that backend."""
+    with semaphores[backend] if semaphores and backend in semaphores else nullcontext():
+        return fn(*args, **kwargs)
+
+def get_name(w3, address, cache=True, semaphores=None):
     """Get a human-readable name for an address by checking ENS and BNS."""
-    ens_name = get_ens_name(w3["mainnet"], address)
+    ens_name = limited(semaphores, "mainnet", get_ens_name, w3["mainnet"], address, cache=cache)
     labels = f"ENS={ens_name}" if ens_name else ""
-    bns_name = get_bns_name(w3["base"], address)
-    labels += " " if labels and bns_name else f"BNS={bns_name}" if bns_name else ""
+    bns_name = limited(semaphores, "base", get_cached_label, w3["base"], address, "bns_name", get_bns_names, cache=cache)
+    labels += (" " if labels else "") + f"BNS={bns_name}" if bns_name else ""
     return labels
 
+def get_names(w3, addresses, cache=True) -> list[str]:
+    """Get `get_name` labels for many addresses, with one batch of aggregated calls per chain."""
+    addresses = list(addresses)
+    ens_names = get_cached_labels(w3["mainnet"], addresses, "ens_name", get_ens_names, cache=cache)
+    bns_names = get_cached_labels(w3["base"], addresses, "bns_name", get_bns_names, cache=cache)
+    names = []
+    for ens_name, bns_name in zip(ens_names, bns_names):
+        labels = f"ENS={ens_name}" if ens_name else ""
+        labels += (" " if labels else "") + f"BNS={bns_name}" if bns_name else ""
+        names.append(labels)
+    return names
+
 def get_etherscan_tag(address, debug=False):
-    """Get contract/address label from Etherscan by scraping the webpage."""
-    try:
-        url = f"https://etherscan.io/address/{address}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=5)
-        if debug:
-            print(f"etherscan {response=}")
-            print(f"etherscan {response.status_code=}")
-        if response.status_code == 200:
-            tree = html.fromstring(response.content)
-            # Try to get the tag using the XPath
-            tag_elements = tree.xpath('/html/body/main/section[3]/div[1]/div[1]/a/div/span')
-            if tag_elements:
-                tag = tag_elements[0].text_content().strip()
-                return tag
-    except Exception:
-        pass
-    return ""
+    """Get contract/address label from Etherscan, see `ExplorerTagClient`."""
+    return get_explorer_client().get_tag("etherscan", address, debug=debug)
 
 def get_basescan_tag(address, debug=False):
-    """Get contract/address label from Basescan by scraping the webpage."""
-    try:
-        url = f"https://basescan.org/address/{address}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=5)
-        if debug:
-            print(f"basescan {response=}")
-            print(f"basescan {response.status_code=}")
-        if response.status_code == 200:
-            tree = html.fromstring(response.content)
-            # Try to get the tag using the XPath
-            tag_elements = tree.xpath('/html/body/main/section[3]/div[1]/div[1]/a/div/span')
-            if tag_elements:
-                tag = tag_elements[0].text_content().strip()
-                return tag
-    except Exception:
-        pass
-    return ""
+    """Get contract/address label from Basescan, see `ExplorerTagClient`."""
+    return get_explorer_client().get_tag("basescan", address, debug=debug)
 
 def get_explorer_tag(address):
-    """Get contract/address label from Compound by scraping the webpage."""
+    """Get contract/address labels from Etherscan and Basescan."""
     etherscan_tag = get_etherscan_tag(address)
     labels = f"Etherscan={etherscan_tag}" if etherscan_tag else ""
     basescan_tag = get_basescan_tag(address)
-    labels += " " if labels else "" + f"BaseScan={basescan_tag}" if basescan_tag else ""
+    labels += (" " if labels else "") + f"BaseScan={basescan_tag}" if basescan_tag else ""
+    return labels
+
+def get_explorer_tags(addresses) -> list[str]:
+    """Get `get_explorer_tag` labels for many addresses, fetching each explorer's pages concurrently."""
+    addresses = list(addresses)
+    client = get_explorer_client()
+    labels = []
+    for etherscan_tag, basescan_tag in zip(client.get_tags("etherscan", addresses), client.get_tags("basescan", addresses)):
+        label = f"Etherscan={etherscan_tag}" if etherscan_tag else ""
+        label += (" " if label else "") + f"BaseScan={basescan_tag}" if basescan_tag else ""
+        labels.append(label)
     return labels
 
-def get_individual_label(w3, network, address, is_safe_wallet=None, is_contract=None, owners=None):
+def get_individual_label(w3, network, address, is_safe_wallet=None, is_contract=None, owners=None, semaphores=None):
     if is_safe_wallet is None or is_contract is None or owners is None:
-        is_safe_wallet, _, owners, _, is_contract = check_safe(w3[network], address, debug=False)
+        is_safe_wallet, _, owners, _, is_contract = limited(semaphores, network, check_safe, w3[network], address, debug=False)
     labels = "Safe" if is_safe_wallet else "Contract" if is_contract else ""
-    name = get_name(w3, address)
-    labels += " " if labels and name else "" + name
-    # explorer_tag = get_explorer_tag(address)
-    # labels += " " if labels and explorer_tag else "" + explorer_tag if explorer_tag else ""
+    name = get_name(w3, address, semaphores=semaphores)
+    labels += (" " if labels else "") + name if name else ""
+    explorer_tag = limited(semaphores, "explorer", get_explorer_tag, address)
+    labels += (" " if labels else "") + explorer_tag if explorer_tag else ""
     return labels
 
-def get_compound_label(w3, network, address, is_safe_wallet, is_contract, owners):
-    labels = get_individual_label(w3, network, address, is_safe_wallet, is_contract, owners)
+def get_compound_label(w3, network, address, is_safe_wallet, is_contract, owners, semaphores=None):
+    labels = get_individual_label(w3, network, address, is_safe_wallet, is_contract, owners, semaphores=semaphores)
     if is_safe_wallet:
         first_owner = owners[0]
-        owner_label = get_name(w3, first_owner)
-        # owner_explorer_tag = get_explorer_tag(first_owner)
-        # owner_label += f" [{owner_explorer_tag}]" if owner_explorer_tag else ""
+        owner_label = get_name(w3, first_owner, semaphores=semaphores)
+        owner_explorer_tag = limited(semaphores, "explorer", get_explorer_tag, first_owner)
+        owner_label += f" [{owner_explorer_tag}]" if owner_explorer_tag else ""
         labels += f" owner: {first_owner} {owner_label}"
     return labels
 
+def resolve_holder_labels(w3, network, address, show_all_safe_owners=False, semaphores=None) -> dict:
+    """Resolve everything `print_holders` shows about one holder.
+
+    Returns:
+        dict: Safe details of the holder, its label, and with `show_all_safe_owners` a label per owner
+    """
+    # Check if address is a Safe
+    is_safe_wallet, version, owners, threshold, is_contract = limited(semaphores, network, check_safe, w3[network], address, debug=False)
+
+    # Label what we know about the address
+    labels = get_compound_label(w3, network, address, is_safe_wallet, is_contract, owners, semaphores=semaphores)
+
+    owner_labels = []
+    if is_safe_wallet and show_all_safe_owners:
+        for owner in owners:
+            tag_label = get_name(w3, owner, semaphores=semaphores)
+            owner_tag = limited(semaphores, "explorer", get_etherscan_tag, owner)
+            tag_label += f" [{owner_tag}]" if owner_tag else ""
+            owner_labels.append((owner, tag_label))
+    return {
+        "is_safe": is_safe_wallet,
+        "version": version,
+        "owners": owners,
+        "threshold": threshold,
+        "labels": labels,
+        "owner_labels": owner_labels,
+    }
+
+def resolve_labels(w3, network, addresses, show_all_safe_owners=False, limits: dict | None = None):
+    """Resolve the labels of many holders concurrently, yielding them in the order given.
+
+    Every lookup holds a slot of its backend while it runs, so each of mainnet RPC, Base RPC
+    and explorer HTTP sees at most `limits[backend]` requests at once, however many
+    holders are in flight. Results are yielded as soon as all earlier ones are done.
+
+    Args:
+        w3: Web3 instances by network name
+        network: Network of the token, whose RPC checks for Safes
+        addresses: Holder addresses, e.g. in rank order
+        show_all_safe_owners: Also label every owner of each Safe
+        limits: Maximum concurrent requests per backend, defaults to `LABEL_CONCURRENCY`
+
+    Yields:
+        dict: Labels of each holder, see `resolve_holder_labels`
+    """
+    addresses = list(addresses)
+    # classify, name and tag every holder and Safe owner at once, so the per-holder lookups below hit the cache
+    owners = []
+    for is_safe, _, safe_owners, _, _ in check_safes(w3[network], addresses):
+        if is_safe and safe_owners:
+            owners.extend(safe_owners if show_all_safe_owners else safe_owners[:1])
+    get_names(w3, list(dict.fromkeys(addresses + owners)))
+    get_explorer_tags(list(dict.fromkeys(addresses + owners)))
+    limits = limits or LABEL_CONCURRENCY
+    semaphores = {backend: threading.BoundedSemaphore(limit) for backend, limit in limits.items()}
+    with ThreadPoolExecutor(max_workers=sum(limits.values())) as executor:
+        yield from executor.map(
+            lambda address: resolve_holder_labels(w3, network, address, show_all_safe_owners, semaphores=semaphores),
+            addresses,
+        )
+
 def print_holders(w3, network, holders, total_supply, decimals, show_all_safe_owners=False):
     with open("holders.csv", "w", encoding="utf-8") as file:
         print(f"{'Rank':<5}{'Address':<40}{'Quantity':>32}{'Percentage':>11} {'Owner':<20}")
         file.write(f"{'Rank'},{'Address'},{'Quantity'},{'Percentage'}, {'Owner'}\n")
-        for i, (addr, balance) in enumerate(holders, 1):
+        # labels are resolved concurrently, and come back in rank order
+        holder_labels = resolve_labels(w3, network, [addr for addr, _ in holders], show_all_safe_owners=show_all_safe_owners)
+        for i, ((addr, balance), holder) in enumerate(zip(holders, holder_labels), 1):
             formatted_balance = format_balance(balance, decimals)
             percentage = (balance / total_supply) if total_supply > 0 else 0
 
-            # Check if address is a Safe
-            is_safe_wallet, version, owners, threshold, is_contract = check_safe(w3[network], addr, debug=False)
-
-            # Label what we know about the address
-            labels = get_compound_label(w3, network, addr, is_safe_wallet, is_contract, owners)
+            labels = holder["labels"]
             print(f"{i:<5}{addr:<40}{formatted_balance:>30}{percentage:>11.4%} {labels:<20}")
             # Write to CSV
             file.write(f"{i},{addr},{formatted_balance},{percentage},{labels}\n")
 
             # If it's a Safe, get its info
-            if is_safe_wallet and show_all_safe_owners:
-                print(f"\n- {threshold}/{len(owners)} Safe (version {version})")
-                if owners:
+            if holder["is_safe"] and show_all_safe_owners:
+                print(f"\n- {holder['threshold']}/{len(holder['owners'])} Safe (version {holder['version']})")
+                if holder["owners"]:
                     print("- Owners:")
-                    for owner in owners:
-                        tag_label = get_name(w3, owner)
-                        owner_tag = get_etherscan_tag(owner)
-                        tag_label += f" [{owner_tag}]" if owner_tag else ""
+                    for owner, tag_label in holder["owner_labels"]:
                         print(f"  - {owner}{f' {tag_label}' if tag_label else ''}")
 
-def query(w3, contract_network, contract_address):
+def query(w3, contract_network, contract_address, top_n: int | None = HOLDERS_TOP_N, block_number: int | None = None):
     print(contract_network, contract_address)
 
-    transfer_logs, contract_of_interest = get_transfer_logs(w3[contract_network], contract_address)
+    transfer_pages, contract_of_interest, start_balances = get_transfer_logs(w3[contract_network], contract_address, block_number=block_number)
 
-    holders, total_supply, decimals = get_holder_stats(transfer_logs, contract_of_interest)
+    holders, total_supply, decimals = get_holder_stats(transfer_pages, contract_of_interest, top_n=top_n, start_balances=start_balances)
     print("")  # Newline to separate holder table from holder stats
     print_holders(w3, contract_network, holders, total_supply, decimals)
 
@@ -269,9 +651,17 @@ def query(w3, contract_network, contract_address):
 
 # %%
 if __name__ == "__main__":
-    if len(sys.argv) < 3 or len(sys.argv) % 2 == 0:
-        print("Usage: python query_holders.py <network> <address> [<network> <address> ...]")
+    USAGE = "Usage: python query_holders.py [--top <n>|all] <network> <address> [<network> <address> ...]"
+    args = sys.argv[1:]
+    top = str(HOLDERS_TOP_N)
+    if "--top" in args:
+        idx = args.index("--top")
+        top = args[idx + 1] if idx + 1 < len(args) else ""
+        del args[idx:idx + 2]
+    if len(args) < 2 or len(args) % 2 == 1 or not (top == "all" or top.isdigit()):
+        print(USAGE)
         sys.exit(1)
+    top_n = None if top == "all" else int(top)
 
     w3 = {
         "base": create_w3("base"),
@@ -279,9 +669,8 @@ if __name__ == "__main__":
     }
 
     contracts = {}
-    # Start from index 1 to skip the script name
-    for i in range(1, len(sys.argv), 2):
-        contracts[sys.argv[i]] = sys.argv[i+1]
+    for i in range(0, len(args), 2):
+        contracts[args[i]] = args[i+1]
 
     for network, address in contracts.items():
-        query(w3, network, address)
+        query(w3, network, address, top_n=top_n)
@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta, timezone
+
+from hexbytes import HexBytes
+
+from hyperstats.block_index import get_block_by_date
+from hyperstats.constants import CONFIRMATION_DEPTH, HYPERDRIVE_MORPHO_ABI
+from hyperstats.event_store import append_pool_samples, get_pool_samples, open_store
+from hyperstats.hyperdrive_math import calc_aprs
+from hyperstats.multicall import decode_call_result, get_multicall_contract, has_multicall3, multicall, pin_block
+from hyperstats.utils import (
+    get_balance_calls,
+    get_pool_deployment,
+    get_pool_immutables,
+    get_vault_shares_balance,
+)
+from hyperstats.web3_utils import batch_request, call_request, get_chain_id
+
+TIMESERIES_COLUMNS = ("block_number", "timestamp", "share_reserves", "bond_reserves", "vault_share_price", "tvl", "spot_apr")
+
+def _fetch_samples(w3, name: str, calls: list, balance_keys: list, block_numbers: list) -> list[dict]:
+    """Read a pool's info and balances at each block, with one multicall and one header per block.
+
+    With Multicall3, all blocks go out as JSON-RPC batches of an `aggregate3` eth_call and an
+    eth_getBlockByNumber each. Without it, blocks are read one at a time.
+    """
+    info_function = calls[0]
+    info_keys = [i['name'] for i in info_function.abi['outputs'][0]['components'] if 'name' in i]
+    if has_multicall3(w3):
+        aggregate = get_multicall_contract(w3).functions.aggregate3(
+            [(call.address, False, call._encode_transaction_data()) for call in calls]  # pylint: disable=protected-access
+        )
+        requests = []
+        for block_number in block_numbers:
+            requests.append(call_request(aggregate, block_number))
+            requests.append(("eth_getBlockByNumber", [hex(block_number), False]))
+        responses = batch_request(w3, requests)
+        results = []
+        for idx, block_number in enumerate(block_numbers):
+            return_data, header = responses[2 * idx], responses[2 * idx + 1]
+            for response in (return_data, header):
+                if isinstance(response, Exception):
+                    raise response
+            values = [decode_call_result(w3, call, call_return_data) for call, (_, call_return_data) in zip(calls, decode_call_result(w3, aggregate, HexBytes(return_data)))]
+            results.append((header["timestamp"], values))
+    else:
+        results = [(w3.eth.get_block(block_number)["timestamp"], multicall(w3, calls, block_identifier=block_number)) for block_number in block_numbers]
+
+    samples = []
+    for block_number, (timestamp, (info_values, *balance_values)) in zip(block_numbers, results):
+        info = dict(zip(info_keys, info_values))
+        samples.append({
+            "blockNumber": block_number,
+            "timestamp": timestamp,
+            "shareReserves": info["shareReserves"],
+            "shareAdjustment": info["shareAdjustment"],
+            "bondReserves": info["bondReserves"],
+            "vaultSharePrice": info["vaultSharePrice"],
+            "shortsOutstanding": info["shortsOutstanding"],
+            "vaultSharesBalance": get_vault_shares_balance(name, dict(zip(balance_keys, balance_values))),
+        })
+    return samples
+
+def sample_pool(w3, pool, block_numbers, cache: bool = True, confirmations: int = CONFIRMATION_DEPTH, immutables: dict | None = None) -> list[dict]:
+    """Return a pool's reserves, share price and balance at each of the given blocks.
+
+    With `cache`, samples are read from the event store and only missing blocks are fetched.
+    Only samples at least `confirmations` blocks deep are stored, so overlapping ranges never
+    fetch a final block twice. Pass the pool's `immutables` if the caller already read them.
+
+    Returns:
+        list[dict]: One sample per block, in the order of `block_numbers`
+    """
+    pool_contract = w3.eth.contract(address=w3.to_checksum_address(pool), abi=HYPERDRIVE_MORPHO_ABI)
+    if immutables is None:
+        immutables = get_pool_immutables(w3, pool_contract, cache=cache)
+    name = immutables["name"]
+    config = dict(immutables["config"])
+    if " LP " in name:
+        config['extraData'] = get_pool_deployment(w3, pool_contract.address, cache=cache)[1]
+    balance_calls = get_balance_calls(w3, pool_contract, name, config, immutables)
+    calls = [pool_contract.functions.getPoolInfo(), *balance_calls.values()]
+
+    block_numbers = list(block_numbers)
+    conn = chain_id = None
+    stored = {}
+    if cache:
+        conn = open_store()
+        chain_id = get_chain_id(w3)
+        stored = get_pool_samples(conn, chain_id, pool_contract.address, block_numbers)
+    missing = sorted({block_number for block_number in block_numbers if block_number not in stored})
+    fetched = {sample["blockNumber"]: sample for sample in _fetch_samples(w3, name, calls, list(balance_calls), missing)}
+    if cache:
+        final_block = w3.eth.get_block_number() - confirmations
+        append_pool_samples(conn, chain_id, pool_contract.address, [sample for block_number, sample in fetched.items() if block_number <= final_block])
+        conn.close()
+    return [stored.get(block_number) or fetched[block_number] for block_number in block_numbers]
+
+def samples_to_columns(config: dict, samples) -> dict[str, list]:
+    """Turn pool samples into `TIMESERIES_COLUMNS` series, computing all spot APRs in one vectorized pass."""
+    samples = list(samples)
+    columns = {column: [] for column in TIMESERIES_COLUMNS}
+    for sample in samples:
+        columns["block_number"].append(sample["blockNumber"])
+        columns["timestamp"].append(sample["timestamp"])
+        columns["share_reserves"].append(sample["shareReserves"])
+        columns["bond_reserves"].append(sample["bondReserves"])
+        columns["vault_share_price"].append(sample["vaultSharePrice"])
+        columns["tvl"].append(sample["vaultSharesBalance"])
+    columns["spot_apr"] = calc_aprs({
+        "shareReserves": columns["share_reserves"],
+        "shareAdjustment": [sample["shareAdjustment"] for sample in samples],
+        "bondReserves": columns["bond_reserves"],
+        "initialVaultSharePrice": config["initialVaultSharePrice"],
+        "timeStretch": config["timeStretch"],
+        "positionDuration": config["positionDuration"],
+    }).tolist() if columns["block_number"] else []
+    return columns
+
+def get_pool_timeseries(w3, pool, from_block: int, to_block: int | None = None, stride: int = 7200, cache: bool = True) -> dict[str, list]:
+    """Sample a pool every `stride` blocks over an inclusive block range.
+
+    The range is clipped to start at the pool's deployment block.
+
+    Args:
+        w3: Web3 instance
+        pool: Pool address
+        from_block: First block of the range
+        to_block: Last block of the range, defaults to latest
+        stride: Number of blocks between samples
+        cache: Read and store samples in the event store
+
+    Returns:
+        dict[str, list]: One series per column of `TIMESERIES_COLUMNS`
+    """
+    to_block = pin_block(w3, to_block)
+    deployment_block, _ = get_pool_deployment(w3, pool, cache=cache)
+    block_numbers = range(max(from_block, deployment_block), to_block + 1, stride)
+    pool_contract = w3.eth.contract(address=w3.to_checksum_address(pool), abi=HYPERDRIVE_MORPHO_ABI)
+    immutables = get_pool_immutables(w3, pool_contract, cache=cache)
+    return samples_to_columns(immutables["config"], sample_pool(w3, pool, block_numbers, cache=cache, immutables=immutables))
+
+def get_pool_timeseries_by_date(w3, pool, start: datetime, end: datetime | None = None, stride: timedelta = timedelta(days=1), cache: bool = True) -> dict[str, list]:
+    """Sample a pool about every `stride` over a date range.
+
+    Both ends are mapped to the first block at or after them through the timestamp index,
+    and the stride is converted to blocks using the average block time between them. The
+    timestamp column holds each sample's actual block time. Naive datetimes are taken as UTC.
+    """
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    from_block = get_block_by_date(w3, start, cache=cache)
+    if end is None:
+        head = w3.eth.get_block("latest")
+        to_block, end_timestamp = head["number"], head["timestamp"]
+    else:
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        to_block, end_timestamp = get_block_by_date(w3, end, cache=cache), end.timestamp()
+    if to_block <= from_block:
+        return get_pool_timeseries(w3, pool, from_block, from_block, cache=cache)
+    # the requested dates are within a block of the blocks found, which is close enough here
+    block_time = (end_timestamp - start.timestamp()) / (to_block - from_block)
+    stride_blocks = max(1, round(stride.total_seconds() / block_time)) if block_time > 0 else 1
+    return get_pool_timeseries(w3, pool, from_block, to_block, stride=stride_blocks, cache=cache)
@@ -1,67 +1,79 @@
+import heapq
 import itertools
-import json
-import os
 import time
-from decimal import Decimal, getcontext
 
 import eth_abi
+import numpy as np
+from eth_utils import get_abi_output_types
 from hexbytes import HexBytes
 
 from hyperstats.constants import (
+    CONFIRMATION_DEPTH,
     ERC20_ABI,
+    ETH_ADDRESS,
     HYPERDRIVE_FACTORY_ABI,
     HYPERDRIVE_MORPHO_ABI,
     HYPERDRIVE_REGISTRY,
     HYPERDRIVE_REGISTRY_ABI,
+    LOG_FETCH_WORKERS,
     MORPHO_ABI,
-    PAGE_SIZE,
+    ZERO_ADDRESS,
     HyperdrivePrefix,
 )
+from hyperstats.deployments import decode_extra_data, get_deployment_info
+from hyperstats.event_store import (
+    append_transfers,
+    get_immutables,
+    get_participants,
+    get_pool_metadata,
+    iter_transfers,
+    open_store,
+    rewind_reorged_tail,
+    set_immutables,
+    set_pool_metadata,
+)
+from hyperstats.multicall import decode_call_result, eth_balance, multicall, pin_block
 from hyperstats.web3_utils import (
+    batch_request,
+    bloom_contains,
     create_w3,
-    fetch_events_logs_with_retry,
+    fetch_events_logs_parallel,
+    find_first_code_block,
+    get_chain_id,
 )
 
-getcontext().prec = 100  # Set precision for Decimal calculations
+# rows of get_pool_positions, balances are uint256 so they stay Python ints
+POSITION_DTYPE = np.dtype([
+    ("user", "U42"),
+    ("trade_type", "U16"),
+    ("prefix", "u1"),
+    ("timestamp", "u8"),
+    ("balance", "O"),
+    ("rewardable", "O"),
+])
+
+# hashes of pool code already read by this process, by (chain_id, pool)
+_code_hashes = {}
 
 # pylint: disable=bare-except
 
-def get_first_contract_block(w3, contract_address):
+def get_first_contract_block(w3, contract_address, probes_per_round: int = 16):
     """Find the first block where a contract's code exists.
 
+    See `find_first_code_block` for how the block is searched.
+
     Args:
         w3: Web3 instance
         contract_address: Address of the contract to search for
+        probes_per_round: Blocks probed per round, capped by the provider's batch size
 
     Returns:
         tuple: (deployment_block, deployment_transaction)
             - deployment_block: Block number where contract was deployed
             - deployment_transaction: Transaction hash and constructor args
     """
-    # do binary search up to latest block
-    latest_block = w3.eth.get_block_number()
-    earliest_block = 0
-
-    # Keep track of first block where we find code
-    first_code_block = None
-
-    while earliest_block <= latest_block:
-        mid_block = (earliest_block + latest_block) // 2
-        attempt_to_get_code = w3.eth.get_code(account=contract_address,block_identifier=mid_block)
-
-        if len(attempt_to_get_code) <= 2:  # "0x" or empty
-            # No code at mid_block, deployment must be after
-            earliest_block = mid_block + 1
-        else:
-            # Found code at mid_block, remember it and look earlier
-            first_code_block = mid_block
-            latest_block = mid_block - 1
-
-    if first_code_block is None:
-        raise ValueError(f"Could not find any block with code for contract {contract_address}")
-
-    # The deployment block is the one we found with code
-    deployment_block = first_code_block
+    # The deployment block is the first one with code
+    deployment_block = find_first_code_block(w3, contract_address, probes_per_round=probes_per_round)
 
     # Now find the deployment transaction
     _, _, receipt = get_deployment_transaction(w3, contract_address, deployment_block=deployment_block)
@@ -75,80 +87,135 @@ def get_first_contract_block(w3, contract_address):
                 topic = log.get('topics', [None])[0]
                 if topic == HexBytes('0xb25b0f0f93209be08152122f1321f6b0ef559a93a67695fff5fea3e5ed234465'):
                     decoded_event = w3.eth.contract(abi=HYPERDRIVE_FACTORY_ABI).events.Deployed().process_log(log)
-                    extra_data = decoded_event['args']['extraData']
-                    extra_data_decoded = HexBytes(extra_data)
-                    if extra_data_decoded[:12] == HexBytes('0x000000000000000000000000'):
-                        extra_data_decoded = HexBytes(extra_data_decoded[12:])
-                    return deployment_block, extra_data_decoded
+                    return deployment_block, decode_extra_data(decoded_event['args']['extraData'])
         except:
             pass
 
     return deployment_block, extra_data
 
-def get_hyperdrive_participants(w3, pool, cache: bool = False, debug: bool = False):
-    target_block = w3.eth.get_block_number()
-    all_users = all_ids = start_block = None
-    if cache and os.path.exists(f"cache/hyperdrive_users_{pool}.json"):
-        with open(f"cache/hyperdrive_users_{pool}.json", "r", encoding="utf-8") as f:
-            all_users = set(json.load(f))
-    else:
-        all_users = set()
-    if cache and os.path.exists(f"cache/hyperdrive_ids_{pool}.json"):
-        with open(f"cache/hyperdrive_ids_{pool}.json", "r", encoding="utf-8") as f:
-            all_ids = set(json.load(f))
-    else:
-        all_ids = set()
-    deployment_block = extra_data = None
-    if cache and os.path.exists(f"cache/hyperdrive_deployment_block_{pool}.json") and os.path.exists(f"cache/hyperdrive_extra_data_{pool}.json"):
-        with open(f"cache/hyperdrive_deployment_block_{pool}.json", "r", encoding="utf-8") as f:
-            deployment_block = json.load(f)
-        with open(f"cache/hyperdrive_extra_data_{pool}.json", "r", encoding="utf-8") as f:
-            extra_data = json.load(f)
+def get_pool_deployment(w3, pool, cache: bool = True) -> tuple[int, HexBytes | None]:
+    """Return a pool's deployment block and decoded extraData.
+
+    Looks in the event store's pool metadata first, then in the network's deployment
+    index, and only then searches for the first block with code. With `cache`, the
+    result is stored as pool metadata for the next run. Without it, neither the pool
+    metadata nor the deployment index is read.
+    """
+    pool = w3.to_checksum_address(pool)
+    conn = chain_id = None
+    if cache:
+        conn = open_store()
+        chain_id = get_chain_id(w3)
+        metadata = get_pool_metadata(conn, chain_id, pool)
+        if metadata is not None:
+            conn.close()
+            return metadata
+    # prefer the network's deployment index over a per-pool code search
+    deployment = get_deployment_info(w3, pool, cache=cache)
+    if deployment is not None:
+        deployment_block, _, extra_data = deployment
     else:
         deployment_block, extra_data = get_first_contract_block(w3, pool)
-    if cache and os.path.exists(f"cache/hyperdrive_latest_block_{pool}.json"):
-        with open(f"cache/hyperdrive_latest_block_{pool}.json", "r", encoding="utf-8") as f:
-            start_block = json.load(f) + 1
-        if start_block >= target_block:
-            print(f"Skipping pool {pool} because it's up to date.")
-            return all_users, all_ids, deployment_block, extra_data
-    else:
-        start_block = deployment_block
-    assert all_users is not None, "error: all_users is None"
-    assert all_ids is not None, "error: all_ids is None"
+    if cache:
+        set_pool_metadata(conn, chain_id, pool, deployment_block, extra_data)
+        conn.close()
+    return deployment_block, extra_data
+
+def apply_transfer_single(ledger: dict, transfer) -> None:
+    """Replay a single `TransferSingle` log into a position ledger.
+
+    Mints come from the zero address and burns go to it. Hyperdrive locks the
+    minimum share reserves by minting LP shares to the zero address, so a log
+    from the zero address to the zero address credits it like `balanceOf` does.
+
+    Args:
+        ledger: Mapping of (user, asset_id) to balance, updated in place
+        transfer: Decoded `TransferSingle` event
+    """
+    from_addr = transfer["args"]["from"]
+    to_addr = transfer["args"]["to"]
+    asset_id = transfer["args"]["id"]
+    value = transfer["args"]["value"]
+    if from_addr != ZERO_ADDRESS:
+        ledger[(from_addr, asset_id)] = ledger.get((from_addr, asset_id), 0) - value
+    if to_addr != ZERO_ADDRESS or from_addr == ZERO_ADDRESS:
+        ledger[(to_addr, asset_id)] = ledger.get((to_addr, asset_id), 0) + value
+
+def build_position_ledger(transfers, ledger: dict | None = None) -> dict:
+    """Fold `TransferSingle` logs into per-(user, asset_id) balances in a single pass.
+
+    Args:
+        transfers: Decoded `TransferSingle` events, in block order
+        ledger: Optional existing ledger to extend
+
+    Returns:
+        dict: Mapping of (user, asset_id) to balance
+    """
+    if ledger is None:
+        ledger = {}
+    for transfer in transfers:
+        apply_transfer_single(ledger, transfer)
+    return ledger
+
+def get_hyperdrive_participants(
+    w3,
+    pool,
+    cache: bool = False,
+    debug: bool = False,
+    ledger: dict | None = None,
+    max_workers: int = LOG_FETCH_WORKERS,
+    confirmations: int = CONFIRMATION_DEPTH,
+):
+    """Collect the users and asset ids of a pool from its `TransferSingle` history.
+
+    With `cache`, decoded logs are kept in the SQLite event store (see `event_store.py`) and
+    only blocks after the pool's sync cursor are fetched. Blocks less than `confirmations`
+    deep are provisional: if they were reorged since the last run, just that tail is rewound
+    and fetched again. The block range is fetched in shards by up to `max_workers` concurrent
+    requests. If `ledger` is a dict, the logs are also replayed into it with
+    `apply_transfer_single`, so it ends up holding every (user, asset_id) balance as of the
+    latest synced block.
+    """
+    head_block = w3.eth.get_block("latest")
+    target_block = head_block["number"]
+    pool = w3.to_checksum_address(pool)
+    conn = chain_id = cursor = None
+    if cache:
+        conn = open_store()
+        chain_id = get_chain_id(w3)
+        cursor = rewind_reorged_tail(w3, conn, chain_id, pool, confirmations=confirmations)
+    deployment_block, extra_data = get_pool_deployment(w3, pool, cache=cache)
+    start_block = cursor + 1 if cursor is not None else deployment_block
+    # a pool that is up to date fetches nothing and returns its stored history below
     assert start_block is not None, "error: start_block is None"
     contract = w3.eth.contract(address=pool, abi=HYPERDRIVE_MORPHO_ABI)
     if debug:
         print("Fetching Hyperdrive events..", end="")
         start_time = time.time()
-    current_block = start_block
-    while current_block < target_block:
-        to_block = min(current_block + PAGE_SIZE, target_block)
-        transfers = fetch_events_logs_with_retry(
-            contract_event=contract.events.TransferSingle(),
-            from_block=current_block,
-            to_block=to_block,
-            delay=0,
-            label=f"Hyperdrive users {pool}",
-        )
-        assert transfers is not None, "error: transfers is None"
-        for transfer in transfers:
-            all_users.add(transfer["args"]["to"])
-            all_ids.add(transfer["args"]["id"])
-        current_block = to_block
+    transfers = fetch_events_logs_parallel(
+        contract_event=contract.events.TransferSingle(),
+        from_block=start_block,
+        to_block=target_block,
+        max_workers=max_workers,
+        label=f"Hyperdrive users {pool}",
+    )
+    assert transfers is not None, "error: transfers is None"
     if debug:
         print(f". done in {time.time() - start_time:0.2f}s")  # type: ignore
+
     if cache:
-        with open(f"cache/hyperdrive_users_{pool}.json", "w", encoding="utf-8") as f:
-            json.dump(list(all_users), f)
-        with open(f"cache/hyperdrive_ids_{pool}.json", "w", encoding="utf-8") as f:
-            json.dump(list(all_ids), f)
-        with open(f"cache/hyperdrive_latest_block_{pool}.json", "w", encoding="utf-8") as f:
-            json.dump(target_block, f)
-        with open(f"cache/hyperdrive_deployment_block_{pool}.json", "w", encoding="utf-8") as f:
-            json.dump(deployment_block, f)
-        with open(f"cache/hyperdrive_extra_data_{pool}.json", "w", encoding="utf-8") as f:
-            json.dump(extra_data, f)
+        # append the new logs, then read the full history back from the store
+        if start_block <= target_block:
+            append_transfers(conn, chain_id, pool, transfers, target_block, head_block["hash"], confirmations=confirmations)
+        all_users, all_ids = get_participants(conn, chain_id, pool)
+        if ledger is not None:
+            build_position_ledger(iter_transfers(conn, chain_id, pool), ledger)
+        conn.close()
+    else:
+        all_users = {transfer["args"]["to"] for transfer in transfers}
+        all_ids = {transfer["args"]["id"] for transfer in transfers}
+        if ledger is not None:
+            build_position_ledger(transfers, ledger)
 
     return all_users, all_ids, deployment_block, extra_data
 
@@ -170,39 +237,41 @@ def get_deployment_transaction(w3, contract_address, deployment_block=None):
     if deployment_block is None:
         deployment_block, _ = get_first_contract_block(w3, contract_address)
     
-    block = w3.eth.get_block(deployment_block, full_transactions=True)
-    contract_address = contract_address.lower()
-    
-    # Look through all transactions in the block
-    for tx in block.transactions:
+    # Get every receipt in the block in one call, or in batches where eth_getBlockReceipts is unsupported
+    try:
+        receipts = w3.eth.get_block_receipts(deployment_block)
+    except Exception:
+        block = w3.eth.get_block(deployment_block)
+        receipts = batch_request(w3, [("eth_getTransactionReceipt", [w3.to_hex(tx_hash)]) for tx_hash in block.transactions])
+
+    address_bytes = bytes.fromhex(contract_address[2:])  # Remove '0x' and convert to bytes
+    address_topic = address_bytes.rjust(32, b'\0')
+    for receipt in receipts:
         try:
-            receipt = w3.eth.get_transaction_receipt(tx.hash)
+            if isinstance(receipt, Exception):
+                raise receipt
 
             # Check direct contract creation
-            if tx.get('to') is None and receipt.get('contractAddress', '').lower() == contract_address:
-                return tx.hash, tx.input, receipt
+            if receipt.get('to') is None and bytes.fromhex((receipt.get('contractAddress') or '0x')[2:]) == address_bytes:
+                return receipt.transactionHash, w3.eth.get_transaction(receipt.transactionHash).input, receipt
+
+            # Skip receipts whose bloom rules out the address as an emitter or topic
+            if not (bloom_contains(receipt.logsBloom, address_bytes) or bloom_contains(receipt.logsBloom, address_topic)):
+                continue
 
             # Check logs for factory deployment events
             for log in receipt.get('logs', []):
                 # Check if the contract address appears in any of:
                 # 1. The log's address (contract that emitted the event)
-                # 2. The topics (indexed event parameters, exact match)
-                # 3. The last 20 bytes of any topic (for packed addresses)
-                address_bytes = bytes.fromhex(contract_address[2:])  # Remove '0x' and convert to bytes
-                if (log.get('address', '').lower() == contract_address or
-                    any(
-                        # Check exact match
-                        topic.hex().lower() == contract_address[2:].lower() or
-                        # Check last 20 bytes
-                        len(topic) >= 20 and topic[-20:] == address_bytes
-                        for topic in log.get('topics', [])
-                    )):
-                    return tx.hash, tx.input, receipt
-                    
+                # 2. The last 20 bytes of any topic (for packed addresses)
+                if (bytes.fromhex(log['address'][2:]) == address_bytes or
+                    any(topic[-20:] == address_bytes for topic in log.get('topics', []))):
+                    return receipt.transactionHash, w3.eth.get_transaction(receipt.transactionHash).input, receipt
+
         except Exception as e:
-            print(f"Error processing transaction {tx.hash}: {e}")
+            print(f"Error processing receipt {receipt}: {e}")
             continue
-    
+
     raise ValueError(f"Could not find deployment transaction for contract {contract_address} in block {deployment_block}")
 
 def decode_asset_id(asset_id: int) -> tuple[int, int]:
@@ -232,17 +301,123 @@ def decode_asset_id(asset_id: int) -> tuple[int, int]:
     timestamp = asset_id & prefix_mask  # apply the prefix mask
     return prefix, timestamp
 
-def get_pool_details(w3, pool_contract, deployment_block: int | None = None, extra_data: str | None = None, debug: bool = False, block_number: int | None = None):
-    block_identifier = block_number or "latest"
+def get_pool_immutables(w3, pool_contract, cache: bool = True) -> dict:
+    """Return the values of a pool that never change after deployment.
+
+    These are its name, its config, the vault and market id of Morpho pools, and the symbol
+    of the token its TVL is counted in. With `cache`, they are read from the event store and
+    only fetched again when the code at the pool's address changes, which is checked once
+    per process.
 
-    # get pool name
-    name = pool_contract.functions.name().call()
+    Returns:
+        dict: name, config, morpho_vault, morpho_market_id and symbol of the pool
+    """
+    return get_pools_immutables(w3, [pool_contract], cache=cache)[0]
+
+def get_pools_immutables(w3, pool_contracts, cache: bool = True) -> list[dict]:
+    """Return `get_pool_immutables` for many pools, fetching the uncached ones in shared batches."""
+    pool_contracts = list(pool_contracts)
+    chain_id = get_chain_id(w3) if cache else None
+    # code hashes only key the cache, so they are not fetched without it
+    unhashed = [pool_contract.address for pool_contract in pool_contracts if (chain_id, pool_contract.address) not in _code_hashes] if cache else []
+    for pool, code in zip(unhashed, batch_request(w3, [("eth_getCode", [pool, "latest"]) for pool in unhashed])):
+        if isinstance(code, Exception):
+            raise code
+        _code_hashes[chain_id, pool] = w3.keccak(code)
+    config_keys = [i['name'] for i in pool_contracts[0].functions.getPoolConfig().abi['outputs'][0]['components'] if 'name' in i] if pool_contracts else []
+    conn = open_store() if cache else None
+    results = []
+    missing = []
+    for pool_contract in pool_contracts:
+        immutables = get_immutables(conn, chain_id, pool_contract.address, _code_hashes[chain_id, pool_contract.address]) if cache else None
+        if immutables is not None:
+            config_function = pool_contract.functions.getPoolConfig()
+            immutables["config"] = dict(zip(config_keys, decode_call_result(w3, config_function, immutables.pop("pool_config"))))
+        else:
+            missing.append(len(results))
+        results.append(immutables)
+
+    # the Morpho getters revert on other pools, so those are allowed to fail
+    getters = ("name", "getPoolConfig", "vault", "collateralToken", "oracle", "irm", "lltv")
+    values = multicall(
+        w3,
+        [getattr(pool_contracts[idx].functions, getter)() for idx in missing for getter in getters],
+        allow_failure=[False, False, True, True, True, True, True] * len(missing),
+    )
+    token_contracts = []
+    for position, idx in enumerate(missing):
+        name, config_values, morpho_vault, collateral_token, oracle, irm, lltv = values[position * len(getters):(position + 1) * len(getters)]
+        config = dict(zip(config_keys, config_values))
+        morpho_market_id = None
+        if "Morpho" in name:
+            morpho_market_id = w3.keccak(eth_abi.encode(  # type: ignore
+                ("address", "address", "address", "address", "uint256"),
+                (config["baseToken"], collateral_token, oracle, irm, lltv),
+            ))
+        else:
+            morpho_vault = None
+        token_contract_address = config['baseToken'] if config['vaultSharesToken'] == ZERO_ADDRESS else config['vaultSharesToken']
+        token_contracts.append(w3.eth.contract(address=w3.to_checksum_address(token_contract_address), abi=ERC20_ABI))
+        results[idx] = {
+            "name": name,
+            "config": config,
+            "morpho_vault": morpho_vault,
+            "morpho_market_id": morpho_market_id,
+            "symbol": None,
+        }
+        if cache:
+            config_function = pool_contracts[idx].functions.getPoolConfig()
+            results[idx]["pool_config"] = w3.codec.encode(get_abi_output_types(config_function.abi), [config_values])
+    # a failed symbol() must not be cached as part of the immutables, so it fails loudly like the rest
+    symbols = multicall(w3, [token_contract.functions.symbol() for token_contract in token_contracts])
+    for idx, symbol in zip(missing, symbols):
+        results[idx]["symbol"] = symbol
+        if cache:
+            set_immutables(conn, chain_id, pool_contracts[idx].address, _code_hashes[chain_id, pool_contracts[idx].address], results[idx])
+            del results[idx]["pool_config"]
+    if cache:
+        conn.close()
+    return results
 
-    # get pool config
-    config_values = pool_contract.functions.getPoolConfig().call()
-    config_outputs = pool_contract.functions.getPoolConfig().abi['outputs'][0]['components']
-    config_keys = [i['name'] for i in config_outputs if 'name' in i]
-    config = dict(zip(config_keys, config_values))
+def get_balance_calls(w3, pool_contract, name: str, config: dict, immutables: dict) -> dict:
+    """Return the calls reading a pool's base and vault token holdings, keyed "base" and "vault"."""
+    balance_calls = {}
+    if config["baseToken"] == ETH_ADDRESS:
+        # the base token is ETH
+        balance_calls["base"] = eth_balance(w3, pool_contract.address)
+    elif " LP " in name:
+        # the base token is an LP token
+        base_token_contract = w3.eth.contract(address=config["extraData"], abi=ERC20_ABI)
+        balance_calls["base"] = base_token_contract.functions.balanceOf(pool_contract.address)
+    elif config["baseToken"] != ZERO_ADDRESS:
+        # regular base token
+        base_token_contract = w3.eth.contract(address=config["baseToken"], abi=ERC20_ABI)
+        balance_calls["base"] = base_token_contract.functions.balanceOf(pool_contract.address)
+    if "Morpho" in name:
+        vault_contract = w3.eth.contract(address=immutables["morpho_vault"], abi=MORPHO_ABI)
+        balance_calls["vault"] = vault_contract.functions.position(immutables["morpho_market_id"], pool_contract.address)
+    elif config["vaultSharesToken"] != ZERO_ADDRESS:
+        vault_shares_contract = w3.eth.contract(address=config["vaultSharesToken"], abi=ERC20_ABI)
+        balance_calls["vault"] = vault_shares_contract.functions.balanceOf(pool_contract.address)
+    return balance_calls
+
+def get_vault_shares_balance(name: str, balances: dict) -> int:
+    if "Morpho" in name:
+        return balances["vault"][0]
+    if "vault" in balances:
+        return balances["vault"]
+    # shares token is null, so we use the base token in its place
+    return balances.get("base")
+
+def get_pool_details(w3, pool_contract, deployment_block: int | None = None, extra_data: str | None = None, debug: bool = False, block_number: int | None = None, cache: bool = True, immutables: dict | None = None):
+    # pin every read to the same block, so the live values below come from consistent state
+    block_identifier = pin_block(w3, block_number)
+
+    # name, config and Morpho market params are immutable, so they come from the cache or the caller
+    if immutables is None:
+        immutables = get_pool_immutables(w3, pool_contract, cache=cache)
+    name = immutables["name"]
+    config = dict(immutables["config"])
     if deployment_block is not None:
         config['deploymentBlock'] = deployment_block
     if extra_data is not None:
@@ -252,10 +427,18 @@ def get_pool_details(w3, pool_contract, deployment_block: int | None = None, ext
         for k,i in config.items():
             print(f" {k:<31} = {i}")
 
+    # LP pools hold their base token at the address in extraData, only known from the deployment
+    if " LP " in name and "extraData" not in config:
+        config['extraData'] = get_pool_deployment(w3, pool_contract.address, cache=cache)[1]
+
+    # query pool info and holdings of base and vault tokens in a single batch
+    balance_calls = get_balance_calls(w3, pool_contract, name, config, immutables)
+    info_function = pool_contract.functions.getPoolInfo()
+    info_values, *balance_values = multicall(w3, [info_function, *balance_calls.values()], block_identifier=block_identifier)
+    balances = dict(zip(balance_calls, balance_values))
+
     # get pool info
-    info_values = pool_contract.functions.getPoolInfo().call(block_identifier=block_identifier)
-    info_outputs = pool_contract.functions.getPoolInfo().abi['outputs'][0]['components']
-    info_keys = [i['name'] for i in info_outputs if 'name' in i]
+    info_keys = [i['name'] for i in info_function.abi['outputs'][0]['components'] if 'name' in i]
     info = dict(zip(info_keys, info_values))
     if debug:
         print("INFO:")
@@ -263,45 +446,15 @@ def get_pool_details(w3, pool_contract, deployment_block: int | None = None, ext
             print(f" {k:<31} = {i}")
     lp_short_positions = info['longExposure']
 
-    # query pool holdings of base and vault tokens
-    base_token_balance = vault_shares_balance = vault_contract_address = vault_contract = vault_shares_contract = None
-    if config["baseToken"] == "0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE":
-        # the base token is ETH
-        base_token_balance = w3.eth.get_balance(pool_contract.address)
-    elif " LP " in name:
-        # the base token is an LP token
-        base_token_contract = w3.eth.contract(address=config["extraData"], abi=ERC20_ABI)
-        base_token_balance = base_token_contract.functions.balanceOf(pool_contract.address).call(block_identifier=block_identifier)
-    elif config["baseToken"] != "0x0000000000000000000000000000000000000000":
-        # regular base token
-        base_token_contract = w3.eth.contract(address=config["baseToken"], abi=ERC20_ABI)
-        base_token_balance = base_token_contract.functions.balanceOf(pool_contract.address).call(block_identifier=block_identifier)
-    if "Morpho" in name:
-        vault_contract_address = pool_contract.functions.vault().call(block_identifier=block_identifier)
-        vault_contract = w3.eth.contract(address=vault_contract_address, abi=MORPHO_ABI)
-        morpho_market_id = w3.keccak(eth_abi.encode(  # type: ignore
-            ("address", "address", "address", "address", "uint256"),
-            (
-                config["baseToken"],
-                pool_contract.functions.collateralToken().call(),
-                pool_contract.functions.oracle().call(),
-                pool_contract.functions.irm().call(),
-                pool_contract.functions.lltv().call(),
-            ),
-        ))
-        vault_shares_balance = vault_contract.functions.position(morpho_market_id,pool_contract.address).call()[0]
-    elif config["vaultSharesToken"] != "0x0000000000000000000000000000000000000000":
-        vault_shares_contract = w3.eth.contract(address=config["vaultSharesToken"], abi=ERC20_ABI)
-        vault_shares_balance = vault_shares_contract.functions.balanceOf(pool_contract.address).call(block_identifier=block_identifier)
-    else:  # shares token is null, so we use the base token in its place
-        vault_shares_balance = base_token_balance
+    base_token_balance = balances.get("base")
+    vault_shares_balance = get_vault_shares_balance(name, balances)
     short_rewardable_tvl = info['shortsOutstanding']
     lp_rewardable_tvl = vault_shares_balance - short_rewardable_tvl
     if debug:
         print("  === calculated values ===")
         print(f" {'base_token_balance':<31} = {base_token_balance}")
         if "Morpho" in name:
-            print(f" {'vault_contract':<31} = {vault_contract_address}")
+            print(f" {'vault_contract':<31} = {immutables['morpho_vault']}")
         print(f" {'vault_shares_balance':<31} = {vault_shares_balance}")
         print(f" {'lp_short_positions':<31} = {lp_short_positions}")
         print(f" {'lp_rewardable_tvl':<31} = {lp_rewardable_tvl}")
@@ -351,44 +504,123 @@ def calc_apr(config, info):
 
     return calculate_apr_from_price(spot_price, config['positionDuration'])
 
-def get_pool_positions(pool_contract, pool_users, pool_ids, lp_rewardable_tvl, short_rewardable_tvl, block = None):
-    pool_positions = []
+def allocate_largest_remainder(total: int, weights) -> list[int]:
+    """Split an integer total pro rata over integer weights, exactly.
+
+    Every share is floored first, then the units lost to flooring go one each to the shares
+    with the largest remainders, so each share is within one unit of its exact value and
+    they always add up to `total`. Ties go to the earlier weight.
+
+    Returns:
+        list[int]: One share per weight, all zero if the weights sum to zero
+    """
+    weights = [int(weight) for weight in weights]
+    weight_sum = sum(weights)
+    if weight_sum == 0:
+        return [0] * len(weights)
+    shares = []
+    remainders = []
+    for weight in weights:
+        share, remainder = divmod(total * weight, weight_sum)
+        shares.append(share)
+        remainders.append(remainder)
+    for idx in heapq.nlargest(total - sum(shares), range(len(weights)), key=remainders.__getitem__):
+        shares[idx] += 1
+    return shares
+
+def get_pool_positions(pool_contract, pool_users, pool_ids, lp_rewardable_tvl, short_rewardable_tvl, block = None, ledger: dict | None = None, spot_check: int = 0):
+    """Attribute rewardable TVL to every position in a pool.
+
+    Balances come from `ledger` when one is given (see `get_hyperdrive_participants`),
+    otherwise every (user, id) pair is queried with `balanceOf`. A ledger reflects the
+    block it was synced to, so pass a matching `block` when spot checking an older one.
+    LP and withdrawal shares split `lp_rewardable_tvl`, shorts split `short_rewardable_tvl`,
+    both with `allocate_largest_remainder`.
+
+    Args:
+        pool_contract: Hyperdrive pool contract
+        pool_users: Users that ever received a position, used without a ledger
+        pool_ids: Asset ids that were ever minted, used without a ledger
+        lp_rewardable_tvl: TVL attributed to LP and withdrawal shares
+        short_rewardable_tvl: TVL attributed to shorts
+        block: Block to query balances at, defaults to latest
+        ledger: Optional mapping of (user, asset_id) to balance
+        spot_check: Number of the largest ledger positions to verify with `balanceOf`
+
+    Returns:
+        np.recarray: Rows of (user, trade_type, prefix, timestamp, balance, rewardable), see `POSITION_DTYPE`
+    """
     combined_prefixes = [(0, 3), (2,)]  # Treat prefixes 0 and 3 together, 2 separately
-    bal_by_prefix = {0: Decimal(0), 1: Decimal(0), 2: Decimal(0), 3: Decimal(0)}
 
     # First pass: collect balances
-    for user, custom_id in itertools.product(pool_users, pool_ids):
-        trade_type, prefix, timestamp = get_trade_details(int(custom_id))
-        bal = pool_contract.functions.balanceOf(int(custom_id), user).call(block_identifier=block or "latest")
-        if bal > Decimal(1):
-            pool_positions.append([user, trade_type, prefix, timestamp, bal, Decimal(0)])
-            bal_by_prefix[prefix] += bal
-
-    # Second pass: calculate shares (prefix 1 (longs) get nothing, so we skip it)
-    for position in pool_positions:
-        prefix = position[2]
-        if prefix in [0, 3]:  # assign rewards for LPs and withdrawal shares
-            combined_lp_balance = bal_by_prefix[0] + bal_by_prefix[3]  # combine LP and withdrawal share balance
-            if combined_lp_balance != Decimal(0):
-                share_of_rewardable = position[4] / combined_lp_balance
-                position[5] = (lp_rewardable_tvl * share_of_rewardable).quantize(Decimal('0'))
-        elif prefix == 2:  # assign rewards for shorts
-            if bal_by_prefix[2] != Decimal(0):
-                share_of_rewardable = position[4] / bal_by_prefix[2]
-                position[5] = (short_rewardable_tvl * share_of_rewardable).quantize(Decimal('0'))
-
-    # Correction step to fix rounding errors
-    for prefixes in combined_prefixes:
-        combined_shares = sum(position[5] for position in pool_positions if position[2] in prefixes)
-        combined_rewardable = lp_rewardable_tvl if prefixes[0] == 0 else short_rewardable_tvl
-        if combined_shares != combined_rewardable and len(pool_positions) > 0:
-            diff = combined_rewardable - combined_shares
-            # Find the position with the largest share among the combined prefixes
-            max_position = max((p for p in pool_positions if p[2] in prefixes), key=lambda x: x[5])
-            max_position[5] += diff
+    if ledger is not None:
+        balances = ((user, custom_id, bal) for (user, custom_id), bal in ledger.items())
+    else:
+        pairs = list(itertools.product(pool_users, pool_ids))
+        onchain_balances = multicall(
+            pool_contract.w3,
+            [pool_contract.functions.balanceOf(int(custom_id), user) for user, custom_id in pairs],
+            block_identifier=block,
+        )
+        balances = ((user, custom_id, bal) for (user, custom_id), bal in zip(pairs, onchain_balances))
+    rows = []
+    for user, custom_id, bal in balances:
+        if bal > 1:
+            trade_type, prefix, timestamp = get_trade_details(int(custom_id))
+            rows.append((user, trade_type, prefix, timestamp, int(bal), 0))
+    pool_positions = np.rec.array(rows, dtype=POSITION_DTYPE) if rows else np.recarray(0, dtype=POSITION_DTYPE)
+
+    # Optionally verify the largest ledger positions against the chain
+    if ledger is not None and spot_check > 0:
+        checked = heapq.nlargest(spot_check, pool_positions, key=lambda position: position.balance)
+        onchain_balances = multicall(
+            pool_contract.w3,
+            [pool_contract.functions.balanceOf((int(position.prefix) << 248) | int(position.timestamp), position.user) for position in checked],
+            block_identifier=block,
+        )
+        for position, onchain_bal in zip(checked, onchain_balances):
+            custom_id = (int(position.prefix) << 248) | int(position.timestamp)
+            if onchain_bal != position.balance:
+                raise ValueError(f"Ledger balance mismatch for {position.user} id {custom_id}: ledger={position.balance} onchain={onchain_bal}")
+
+    # Second pass: split each rewardable TVL over its positions (prefix 1 (longs) get nothing)
+    for prefixes, rewardable_tvl in zip(combined_prefixes, (lp_rewardable_tvl, short_rewardable_tvl)):
+        group = np.flatnonzero(np.isin(pool_positions.prefix, prefixes))
+        pool_positions.rewardable[group] = allocate_largest_remainder(int(rewardable_tvl), pool_positions.balance[group])
 
     return pool_positions
 
+def get_pool_snapshot(w3, pool, block_number: int | None = None, cache: bool = True) -> dict:
+    """Read the current state of a pool without scanning its event history.
+
+    Deployment metadata is only looked up for " LP " pools, through the cached
+    `get_pool_deployment`, since only they need extraData to find their balance.
+
+    Args:
+        w3: Web3 instance
+        pool: Pool address
+        block_number: Block to read at, defaults to latest
+        cache: Read immutable values and deployment metadata from the event store
+
+    Returns:
+        dict: pool, name, config, info, vault_shares_balance, lp_rewardable_tvl,
+            short_rewardable_tvl, symbol and apr of the pool
+    """
+    pool_contract = w3.eth.contract(address=w3.to_checksum_address(pool), abi=HYPERDRIVE_MORPHO_ABI)
+    immutables = get_pool_immutables(w3, pool_contract, cache=cache)
+    config, info, name, vault_shares_balance, lp_rewardable_tvl, short_rewardable_tvl = get_pool_details(w3, pool_contract, block_number=block_number, cache=cache, immutables=immutables)
+    return {
+        "pool": pool_contract.address,
+        "name": name,
+        "config": config,
+        "info": info,
+        "vault_shares_balance": vault_shares_balance,
+        "lp_rewardable_tvl": lp_rewardable_tvl,
+        "short_rewardable_tvl": short_rewardable_tvl,
+        "symbol": immutables["symbol"],
+        "apr": calc_apr(config, info),
+    }
+
 def get_trade_details(asset_id: int) -> tuple[str, int, int]:
     prefix, timestamp = decode_asset_id(asset_id)
     trade_type = HyperdrivePrefix(prefix).name
@@ -396,20 +628,77 @@ def get_trade_details(asset_id: int) -> tuple[str, int, int]:
 
 def get_tvl_for_pool(w3, pool) -> str:
     pool_to_test_contract = w3.eth.contract(address=w3.to_checksum_address(pool), abi=HYPERDRIVE_MORPHO_ABI)
-    config, _, name, vault_shares_balance, _, _ = get_pool_details(w3, pool_to_test_contract)
-    token_contract_address = config['baseToken'] if config['vaultSharesToken'] == "0x0000000000000000000000000000000000000000" else config['vaultSharesToken']
-    token_contract = w3.eth.contract(address=w3.to_checksum_address(token_contract_address), abi=ERC20_ABI)
-    tvl_string = f"{name:<58}({pool[:8]}) {vault_shares_balance:>32} {token_contract.functions.symbol().call():>5}"
+    immutables = get_pool_immutables(w3, pool_to_test_contract)
+    _, _, name, vault_shares_balance, _, _ = get_pool_details(w3, pool_to_test_contract, immutables=immutables)
+    symbol = immutables["symbol"]
+    tvl_string = f"{name:<58}({pool[:8]}) {vault_shares_balance:>32} {symbol:>5}"
     return tvl_string
 
-def get_tvl_for_network(w3, network) -> str:
-    hyperdrive_registry_contract = w3.eth.contract(address=w3.to_checksum_address(HYPERDRIVE_REGISTRY[network]), abi=HYPERDRIVE_REGISTRY_ABI)
-    number_of_instances = hyperdrive_registry_contract.functions.getNumberOfInstances().call()
-    instance_list = hyperdrive_registry_contract.functions.getInstancesInRange(0,number_of_instances).call()
+def get_network_state(w3, network, block_number: int | None = None) -> list[dict]:
+    """Read the state of every pool in a network's registry, pinned to a single block.
+
+    The instance list comes from the registry. Then one multicall reads the registry
+    metadata of all instances together with each pool's `getPoolInfo` and balances. Immutable
+    pool values come from the cache of `get_pools_immutables`, which fetches any missing
+    ones in shared batches.
+
+    Args:
+        w3: Web3 instance
+        network: Network name
+        block_number: Block to read at, defaults to latest
+
+    Returns:
+        list[dict]: One row per pool in registry order, with pool, name, kind, version, factory,
+            config, info, vault_shares_balance, lp_rewardable_tvl, short_rewardable_tvl, symbol,
+            apr and block_number
+    """
+    block_identifier = pin_block(w3, block_number)
+    registry = w3.eth.contract(address=w3.to_checksum_address(HYPERDRIVE_REGISTRY[network]), abi=HYPERDRIVE_REGISTRY_ABI)
+    number_of_instances = registry.functions.getNumberOfInstances().call(block_identifier=block_identifier)
+    instance_list = registry.functions.getInstancesInRange(0, number_of_instances).call(block_identifier=block_identifier)
+    pool_contracts = [w3.eth.contract(address=w3.to_checksum_address(pool), abi=HYPERDRIVE_MORPHO_ABI) for pool in instance_list]
+    pools_immutables = get_pools_immutables(w3, pool_contracts)
+
+    calls = [registry.functions.getInstanceInfosWithMetadata(instance_list)]
+    pool_balance_calls = []
+    for pool_contract, immutables in zip(pool_contracts, pools_immutables):
+        config = dict(immutables["config"])
+        if " LP " in immutables["name"]:
+            config['extraData'] = get_pool_deployment(w3, pool_contract.address)[1]
+        balance_calls = get_balance_calls(w3, pool_contract, immutables["name"], config, immutables)
+        pool_balance_calls.append((config, balance_calls))
+        calls.append(pool_contract.functions.getPoolInfo())
+        calls.extend(balance_calls.values())
+    results = iter(multicall(w3, calls, block_identifier=block_identifier))
+
+    instance_infos = next(results)
+    info_keys = [i['name'] for i in pool_contracts[0].functions.getPoolInfo().abi['outputs'][0]['components'] if 'name' in i] if pool_contracts else []
+    rows = []
+    for pool_contract, immutables, (_, factory, _, kind, version), (config, balance_calls) in zip(pool_contracts, pools_immutables, instance_infos, pool_balance_calls):
+        info = dict(zip(info_keys, next(results)))
+        balances = {key: next(results) for key in balance_calls}
+        vault_shares_balance = get_vault_shares_balance(immutables["name"], balances)
+        rows.append({
+            "pool": pool_contract.address,
+            "name": immutables["name"],
+            "kind": kind,
+            "version": version,
+            "factory": factory,
+            "config": config,
+            "info": info,
+            "vault_shares_balance": vault_shares_balance,
+            "lp_rewardable_tvl": vault_shares_balance - info['shortsOutstanding'],
+            "short_rewardable_tvl": info['shortsOutstanding'],
+            "symbol": immutables["symbol"],
+            "apr": calc_apr(config, info),
+            "block_number": block_identifier,
+        })
+    return rows
 
+def get_tvl_for_network(w3, network) -> str:
     tvl_string = ''
-    for pool in instance_list:
-        tvl_string += get_tvl_for_pool(w3, pool)
+    for row in get_network_state(w3, network):
+        tvl_string += f"{row['name']:<58}({row['pool'][:8]}) {row['vault_shares_balance']:>32} {row['symbol']:>5}"
 
     return tvl_string
 
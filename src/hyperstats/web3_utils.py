@@ -1,12 +1,24 @@
+import contextvars
 import logging
 import os
+import random
 import re
 import time
 import traceback
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
+from ens.exceptions import InvalidName
+from ens.utils import normal_name_to_hash
 from web3 import Web3
+from web3._utils.method_formatters import PYTHONIC_RESULT_FORMATTERS
+from web3.datastructures import AttributeDict
+from web3.exceptions import Web3RPCError
 from web3.middleware import ExtraDataToPOAMiddleware
 
+from hyperstats.constants import LOG_FETCH_WORKERS, PAGE_SIZE, RPC_BATCH_SIZE, ZERO_ADDRESS
+from hyperstats.multicall import multicall, pin_block
+
 # pylint: disable=redefined-builtin
 
 # Chain configurations for Base networks
@@ -49,57 +61,151 @@ RESOLVER_ABI = [
         "outputs": [{"internalType": "string", "name": "", "type": "string"}],
         "stateMutability": "view",
         "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "bytes32", "name": "node", "type": "bytes32"}],
+        "name": "addr",
+        "outputs": [{"internalType": "address payable", "name": "", "type": "address"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+# reverse records live under addr.reverse on mainnet, and under the coin type of Base
+# (0x80000000 | 8453) for BNS
+ENS_REVERSE_NAMESPACE = "addr.reverse"
+BNS_REVERSE_NAMESPACE = "80002105.reverse"
+
+# ENS Constants
+ENS_REGISTRY_ADDRESS = "0x00000000000C2E074eC69A0dFb2997BA6C7d2e1e"
+
+ENS_REGISTRY_ABI = [
+    {
+        "inputs": [{"internalType": "bytes32", "name": "node", "type": "bytes32"}],
+        "name": "resolver",
+        "outputs": [{"internalType": "address", "name": "", "type": "address"}],
+        "stateMutability": "view",
+        "type": "function"
     }
 ]
 
-def get_bns_name(provider: Web3, address: str) -> str:
+# Web3 instances whose reverse registrar agreed with the locally computed BNS nodes
+_bns_nodes_checked = weakref.WeakKeyDictionary()
+
+def get_reverse_node(address: str, namespace: str = ENS_REVERSE_NAMESPACE) -> bytes:
+    """Return the node of an address's reverse record, as reverse registrars compute it."""
+    return get_namehash(f"{address.lower().removeprefix('0x')}.{namespace}")
+
+def get_bns_names(provider: Web3, addresses) -> list[str]:
+    """Look up the BNS names of many addresses in one aggregated call.
+
+    Reverse nodes are computed locally. The first lookup on a Web3 instance also asks the
+    reverse registrar for one node, in the same aggregated call, to check them.
+
+    Args:
+        provider: Web3 instance on Base
+        addresses: Addresses to look up
+
+    Returns:
+        list[str]: Resolved BNS names, or empty strings if not found, in the same order
+
+    Raises:
+        ValueError: If the reverse registrar computes nodes differently
+    """
+    addresses = [provider.to_checksum_address(address) for address in addresses]
+    if not addresses:
+        return []
+    resolver = provider.eth.contract(address=provider.to_checksum_address(L2_RESOLVER_ADDRESS), abi=RESOLVER_ABI)
+    nodes = [get_reverse_node(address, BNS_REVERSE_NAMESPACE) for address in addresses]
+    calls = [resolver.functions.name(node) for node in nodes]
+    check_node = provider not in _bns_nodes_checked
+    if check_node:
+        reverse_registrar = provider.eth.contract(address=provider.to_checksum_address(REVERSE_REGISTRAR_ADDRESS), abi=REVERSE_REGISTRAR_ABI)
+        calls.append(reverse_registrar.functions.node(addresses[0]))
+    names = multicall(provider, calls, allow_failure=True)
+    if check_node:
+        registrar_node = names.pop()
+        if registrar_node is not None:
+            if registrar_node != nodes[0]:
+                raise ValueError(f"BNS reverse node of {addresses[0]} is {registrar_node.hex()}, expected {nodes[0].hex()}")
+            _bns_nodes_checked[provider] = True
+    return [name or "" for name in names]
+
+def get_bns_name(provider: Web3, address: str, strict: bool = False) -> str:
     """Look up the BNS name associated with a given address.
 
     Args:
         provider: Web3 provider instance
         address: Ethereum address to look up
+        strict: Raise lookup errors instead of returning an empty string
 
     Returns:
         str: Resolved BNS name or empty string if not found
     """
     try:
-        # Convert address to checksum format
-        address = provider.to_checksum_address(address)
-
-        # Create contract instances
-        reverse_registrar = provider.eth.contract(
-            address=provider.to_checksum_address(REVERSE_REGISTRAR_ADDRESS),
-            abi=REVERSE_REGISTRAR_ABI
-        )
-        resolver = provider.eth.contract(
-            address=provider.to_checksum_address(L2_RESOLVER_ADDRESS),
-            abi=RESOLVER_ABI
-        )
-
-        # Get node from reverse registrar
-        node = reverse_registrar.functions.node(address).call()
-
-        # Get name from resolver
-        name = resolver.functions.name(node).call()
-        return name
+        return get_bns_names(provider, [address])[0]
 
     except Exception as error:
+        if strict:
+            raise
         print(f"Error in BNS lookup: {error}")
         return ""
 
+def get_ens_names(provider: Web3, addresses) -> list[str]:
+    """Look up the primary ENS names of many addresses, verified like `w3.ens.name`.
+
+    Reverse nodes are computed locally, then four aggregated calls pinned to one block read
+    the reverse resolvers, the names, the names' resolvers and the addresses they resolve
+    to. A name only counts if it resolves back to its address. Names without a resolver on
+    their own node may use an ENSIP-10 wildcard resolver of a parent, e.g. `*.cb.id`, so
+    those addresses fall back to `w3.ens.name`, one at a time.
+
+    Args:
+        provider: Web3 instance on mainnet
+        addresses: Addresses to look up
+
+    Returns:
+        list[str]: Verified ENS names, or empty strings if not found, in the same order
+    """
+    addresses = [provider.to_checksum_address(address) for address in addresses]
+    if not addresses:
+        return []
+    block = pin_block(provider)
+    registry = provider.eth.contract(address=ENS_REGISTRY_ADDRESS, abi=ENS_REGISTRY_ABI)
+
+    def resolve(nodes: dict, function_name: str) -> tuple[dict, set]:
+        # ask each node's resolver, for nodes that have one
+        resolvers = multicall(provider, [registry.functions.resolver(node) for node in nodes.values()], block_identifier=block, allow_failure=True)
+        pending = {idx: (resolver, node) for (idx, node), resolver in zip(nodes.items(), resolvers) if resolver not in (None, ZERO_ADDRESS)}
+        results = multicall(
+            provider,
+            [getattr(provider.eth.contract(address=resolver, abi=RESOLVER_ABI).functions, function_name)(node) for resolver, node in pending.values()],
+            block_identifier=block,
+            allow_failure=True,
+        )
+        return {idx: result for idx, result in zip(pending, results) if result}, set(nodes) - set(pending)
+
+    names, _ = resolve({idx: get_reverse_node(address) for idx, address in enumerate(addresses)}, "name")
+    forward_nodes = {}
+    for idx, name in names.items():
+        try:
+            forward_nodes[idx] = normal_name_to_hash(name)
+        except InvalidName:
+            pass  # names that do not normalize cannot resolve back
+    resolved, without_resolver = resolve(forward_nodes, "addr")
+    verified = [names[idx] if resolved.get(idx) == address else "" for idx, address in enumerate(addresses)]
+    for idx in without_resolver:
+        verified[idx] = provider.ens.name(addresses[idx]) or ""
+    return verified
+
 def get_namehash(name: str) -> bytes:
     """Calculate the namehash for a domain name."""
     if not name:
         return b'\0' * 32
 
-    # For reverse address lookup
-    if name.endswith('.addr.reverse'):
-        # Special handling for reverse lookup
-        labels = name.split('.')
-
-        # The address part needs to be split into individual characters
-        addr_chars = list(labels[0])  # Split address into individual characters
-        labels = addr_chars + labels[1:]  # Add back 'addr' and 'reverse'
+    # For reverse address lookup, the address is a single lowercase hex label
+    if name.endswith('.reverse'):
+        labels = name.lower().split('.')
     else:
         # Remove .eth suffix if present
         if name.endswith('.eth'):
@@ -146,12 +252,158 @@ def get_address(provider: Web3, name: str) -> str:
         print(f"Error resolving address for {name}: {error}")
         return ""
 
-def create_w3(network):
-    w3 = Web3(Web3.HTTPProvider(f"https://{'eth' if network == 'mainnet' else network}-mainnet.g.alchemy.com/v2/{os.getenv('ALCHEMY_KEY')}"))
+class BatchHTTPProvider(Web3.HTTPProvider):
+    """HTTP provider that can also send independent requests as JSON-RPC batch arrays.
+
+    Regular requests behave exactly like `Web3.HTTPProvider`. `batch_request` uses
+    `max_batch_size` to decide how many requests go into each array.
+    """
+
+    def __init__(self, endpoint_uri=None, max_batch_size: int | None = RPC_BATCH_SIZE, **kwargs):
+        super().__init__(endpoint_uri, **kwargs)
+        self.max_batch_size = max_batch_size
+
+def create_w3(network, max_batch_size: int | None = RPC_BATCH_SIZE):
+    """Create a Web3 instance for a network.
+
+    Args:
+        network: Network name, e.g. "mainnet" or "base"
+        max_batch_size: Maximum requests per JSON-RPC batch, or None to send them one by one
+    """
+    w3 = Web3(BatchHTTPProvider(f"https://{'eth' if network == 'mainnet' else network}-mainnet.g.alchemy.com/v2/{os.getenv('ALCHEMY_KEY')}", max_batch_size=max_batch_size))
     if network == "linea":
         w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
     return w3
 
+_chain_ids = weakref.WeakKeyDictionary()
+
+def get_chain_id(w3) -> int:
+    """Return the chain id of a Web3 instance, fetching it only once."""
+    if w3 not in _chain_ids:
+        _chain_ids[w3] = w3.eth.chain_id
+    return _chain_ids[w3]
+
+def call_request(contract_function, block_identifier="latest") -> tuple:
+    """Build an eth_call request for `batch_request` from a bound contract function."""
+    if isinstance(block_identifier, int):
+        block_identifier = hex(block_identifier)
+    return ("eth_call", [{"to": contract_function.address, "data": contract_function._encode_transaction_data()}, block_identifier])  # pylint: disable=protected-access
+
+def _format_batch_response(method, response):
+    """Format a raw response like the matching `w3.eth` method would, or return its error."""
+    if "error" in response:
+        return Web3RPCError(f"{method}: {response['error']}", rpc_response=response)
+    result = response.get("result")
+    if result is None:
+        return None
+    # batches skip the middleware, so mirror ExtraDataToPOAMiddleware for long extraData
+    if isinstance(result, dict) and len(result.get("extraData") or "") > 66:
+        result["proofOfAuthorityData"] = result.pop("extraData")
+    try:
+        if method in PYTHONIC_RESULT_FORMATTERS:
+            result = PYTHONIC_RESULT_FORMATTERS[method](result)
+    except Exception as e:
+        return e
+    return AttributeDict.recursive(result) if isinstance(result, dict) else result
+
+def _send_batch(w3, requests) -> list:
+    """Send one batch array, halving it if the node rejects the batch as a whole."""
+    response = w3.provider.make_batch_request(requests)
+    if isinstance(response, list):
+        return [_format_batch_response(method, item) for (method, _), item in zip(requests, response)]
+    if len(requests) == 1:
+        return [_format_batch_response(requests[0][0], response)]
+    mid = len(requests) // 2
+    print(f"batch of {len(requests)} requests rejected ({response.get('error')})\n => splitting into {mid} and {len(requests) - mid}")
+    return _send_batch(w3, requests[:mid]) + _send_batch(w3, requests[mid:])
+
+def batch_request(w3, requests, max_batch_size: int | None = None) -> list:
+    """Send independent JSON-RPC requests in as few HTTP round-trips as possible.
+
+    Requests are sent as batch arrays of at most `max_batch_size` items, which defaults to
+    the provider's own `max_batch_size`. Providers without batch support get one request
+    at a time. A failed item does not fail the batch: its slot holds the exception instead.
+
+    Args:
+        w3: Web3 instance
+        requests: (method, params) tuples with RPC-encoded params, e.g. ("eth_getCode", [address, "latest"])
+        max_batch_size: Override for the maximum number of requests per batch
+
+    Returns:
+        list: Formatted results, or exceptions for failed items, in the same order as `requests`
+    """
+    requests = list(requests)
+    if max_batch_size is None:
+        max_batch_size = getattr(w3.provider, "max_batch_size", None)
+    results = []
+    if not max_batch_size:
+        for method, params in requests:
+            try:
+                results.append(_format_batch_response(method, w3.provider.make_request(method, params)))
+            except Exception as e:
+                results.append(e)
+        return results
+    for batch_start in range(0, len(requests), max_batch_size):
+        results.extend(_send_batch(w3, requests[batch_start:batch_start + max_batch_size]))
+    return results
+
+def bloom_contains(bloom: bytes, value: bytes) -> bool:
+    """Check whether a value (log address or topic) may be present in a 2048-bit logs bloom.
+
+    False means the value is definitely absent, True means it is probably present.
+    """
+    value_hash = Web3.keccak(value)
+    for i in (0, 2, 4):
+        bit = ((value_hash[i] << 8) | value_hash[i + 1]) & 2047
+        if not bloom[255 - bit // 8] & (1 << (bit % 8)):
+            return False
+    return True
+
+def find_first_code_block(w3, contract_address, probes_per_round: int = 16) -> int:
+    """Find the first block where a contract's code exists.
+
+    Each round probes up to `probes_per_round` evenly spaced blocks in one JSON-RPC batch,
+    which takes about 6 round-trips on mainnet instead of 25 for a plain binary search.
+
+    Args:
+        w3: Web3 instance
+        contract_address: Address of the contract to search for
+        probes_per_round: Blocks probed per round, capped by the provider's batch size
+
+    Returns:
+        int: Block number where the contract was deployed
+    """
+    # do a k-ary search up to latest block
+    latest_block = w3.eth.get_block_number()
+    earliest_block = 0
+    probes_per_round = max(1, min(probes_per_round, getattr(w3.provider, "max_batch_size", None) or 1))
+
+    # Keep track of first block where we find code
+    first_code_block = None
+
+    while earliest_block <= latest_block:
+        probe_blocks = sorted({earliest_block + (latest_block - earliest_block) * (i + 1) // (probes_per_round + 1) for i in range(probes_per_round)})
+        codes = batch_request(w3, [("eth_getCode", [contract_address, hex(block)]) for block in probe_blocks])
+        for code in codes:
+            if isinstance(code, Exception):
+                raise code
+
+        # code never disappears once deployed, so the first probe with code bounds the search
+        first_with_code = next((i for i, code in enumerate(codes) if len(code) > 0), None)
+        if first_with_code is None:
+            # No code at any probe, deployment must be after the last one
+            earliest_block = probe_blocks[-1] + 1
+        else:
+            # Found code, remember it and look between the previous probe and this one
+            first_code_block = probe_blocks[first_with_code]
+            latest_block = first_code_block - 1
+            if first_with_code > 0:
+                earliest_block = probe_blocks[first_with_code - 1] + 1
+
+    if first_code_block is None:
+        raise ValueError(f"Could not find any block with code for contract {contract_address}")
+    return first_code_block
+
 def parse_suggested_block_range(error_message):
     """Extract suggested block range from RPC error message."""
     match = re.search(r'\[0x([a-f0-9]+), 0x([a-f0-9]+)\]', error_message)
@@ -161,68 +413,146 @@ def parse_suggested_block_range(error_message):
         return start_block, end_block
     return None, None
 
-def fetch_events_logs_with_retry(
+# errors meaning the range returned too much data or took too long, so it should be split
+LOG_RANGE_ERRORS = re.compile(
+    r"log response size exceeded|query returned more than|response size|too many (logs|results)|range is too (large|wide)|block range|timeout|timed out|-32005",
+    re.IGNORECASE,
+)
+# errors meaning the provider is throttling us, so we should back off
+RATE_LIMIT_ERRORS = re.compile(r"429|too many requests|rate limit|exceeded its compute units", re.IGNORECASE)
+# number of consecutive successful pages before the window is doubled again
+LOG_WINDOW_GROWTH_STREAK = 3
+
+# last window size that worked for each contract, shared by every fetch in this process
+_log_windows: dict[str, int] = {}
+
+def iter_events_logs(
     contract_event,
     from_block: int,
     to_block: int | str = "latest",
-    retries: int = 3,
-    delay: int = 2,
+    retries: int = 5,
+    delay: float = 1,
     label: str | None = None,
     filter: dict | None = None,
-) -> list:
-    """Fetch event logs with retry logic and handling of block range limits."""
+    max_window: int = PAGE_SIZE,
+):
+    """Yield event logs page by page, adapting the block window to the provider.
+
+    A page that fails because of too many results or a timeout is bisected (or cut to the
+    range the provider suggests) and retried, and the window doubles again after a streak of
+    successes. The window that last worked is remembered per contract, so later fetches start
+    there. Rate limits and other errors are retried with jittered exponential backoff.
+
+    Args:
+        contract_event: Contract event to fetch, e.g. `contract.events.Transfer()`
+        from_block: First block of the range
+        to_block: Last block of the range (inclusive), or "latest"
+        retries: Attempts per page before giving up on errors that are not about size
+        delay: Base delay in seconds for the exponential backoff
+        label: Description used in error messages
+        filter: Optional argument filters for the event
+        max_window: Largest number of blocks requested at once
+
+    Yields:
+        list: Logs of one page, in block order
+    """
     if isinstance(to_block, str) and to_block == "latest":
         to_block = contract_event.w3.eth.block_number
 
+    key = contract_event.address
+    window = min(_log_windows.get(key, max_window), max_window)
     current_from_block = from_block
-    all_logs = []
+    successes = attempt = 0
 
     while current_from_block <= to_block:
-        for attempt in range(retries):
-            try:
-                logs = contract_event.get_logs(
-                    from_block=current_from_block,
-                    to_block=to_block if filter is None else None,
-                    argument_filters=filter
-                )
-                all_logs.extend(logs)
-                return all_logs
-            except Exception as e:
-                if "Log response size exceeded" in str(e):
-                    suggested_start, suggested_end = parse_suggested_block_range(str(e))
-                    if suggested_start and suggested_end:
-                        # Use suggested range for next iteration
-                        print(f"log response size exceeded\n => re-querying with {suggested_start=}, {suggested_end=}")
-                        logs = contract_event.get_logs(
-                            from_block=current_from_block,
-                            to_block=suggested_end,
-                            argument_filters=filter
-                        )
-                        all_logs.extend(logs)
-                        current_from_block = suggested_end + 1
-                        break
-                    else:
-                        # If can't parse suggested range, use a smaller fixed range
-                        next_block = min(current_from_block + 2000, to_block)
-                        print(f"log response size exceeded\n => re-querying with {current_from_block=}, {next_block=}")
-                        logs = contract_event.get_logs(
-                            from_block=current_from_block,
-                            to_block=next_block,
-                            argument_filters=filter
-                        )
-                        all_logs.extend(logs)
-                        current_from_block = next_block + 1
-                        break
-                elif attempt < retries - 1:
-                    time.sleep(delay)
-                    continue
+        current_to_block = min(current_from_block + window - 1, to_block)
+        try:
+            logs = contract_event.get_logs(
+                from_block=current_from_block,
+                to_block=current_to_block,
+                argument_filters=filter
+            )
+        except Exception as e:
+            message = str(e)
+            if not RATE_LIMIT_ERRORS.search(message) and LOG_RANGE_ERRORS.search(message) and current_to_block > current_from_block:
+                _, suggested_end = parse_suggested_block_range(message)
+                if suggested_end is not None and current_from_block <= suggested_end < current_to_block:
+                    window = suggested_end - current_from_block + 1
                 else:
-                    msg = (
-                        f"Error getting events logs"
-                        f" for {label}" if label is not None else ""
-                        f": {e}, {traceback.format_exc()}"
-                    )
-                    logging.error(msg)
-                    raise e
+                    window = max(1, (current_to_block - current_from_block + 1) // 2)
+                _log_windows[key] = window
+                successes = 0
+                print(f"log range too large\n => re-querying with {current_from_block=}, {window=}")
+                continue
+            attempt += 1
+            if attempt >= retries:
+                msg = f"Error getting events logs{f' for {label}' if label is not None else ''}: {e}, {traceback.format_exc()}"
+                logging.error(msg)
+                raise e
+            time.sleep(delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            continue
+
+        attempt = 0
+        yield logs
+        current_from_block = current_to_block + 1
+        successes += 1
+        if successes >= LOG_WINDOW_GROWTH_STREAK and window < max_window:
+            window = min(window * 2, max_window)
+            successes = 0
+        _log_windows[key] = window
 
+def fetch_events_logs_with_retry(
+    contract_event,
+    from_block: int,
+    to_block: int | str = "latest",
+    retries: int = 5,
+    delay: float = 1,
+    label: str | None = None,
+    filter: dict | None = None,
+) -> list:
+    """Fetch event logs with retry logic and handling of block range limits.
+
+    See `iter_events_logs` for how the block window adapts to the provider.
+    """
+    all_logs = []
+    for logs in iter_events_logs(contract_event, from_block, to_block, retries=retries, delay=delay, label=label, filter=filter):
+        all_logs.extend(logs)
+    return all_logs
+
+def fetch_events_logs_parallel(
+    contract_event,
+    from_block: int,
+    to_block: int,
+    shard_size: int = PAGE_SIZE,
+    max_workers: int = LOG_FETCH_WORKERS,
+    label: str | None = None,
+    filter: dict | None = None,
+) -> list:
+    """Fetch event logs for a block range as shards fetched concurrently.
+
+    The inclusive range is split into shards of at most `shard_size` blocks, made smaller
+    if needed so every worker gets one. At most `max_workers` shards are in flight at once,
+    each through `fetch_events_logs_with_retry`, and the results are merged in block order.
+    """
+    if to_block < from_block:
+        return []
+    shard_size = max(1, min(shard_size, -(-(to_block - from_block + 1) // max_workers)))
+    shards = [(start, min(start + shard_size - 1, to_block)) for start in range(from_block, to_block + 1, shard_size)]
+
+    def fetch_shard(shard):
+        return fetch_events_logs_with_retry(
+            contract_event=contract_event,
+            from_block=shard[0],
+            to_block=shard[1],
+            label=label,
+            filter=filter,
+        )
+
+    all_logs = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # shards run in copies of the caller's context, so output buffered per job stays with its job
+        futures = [executor.submit(contextvars.copy_context().run, fetch_shard, shard) for shard in shards]
+        # collect in submission order, which is block order
+        for future in futures:
+            all_logs.extend(future.result())
     return all_logs
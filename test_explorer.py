@@ -0,0 +1,71 @@
+# %%
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TAGGED = "0x" + "11" * 20
+UNTAGGED = "0x" + "22" * 20
+BUSY = "0x" + "33" * 20
+CHALLENGE = "0x" + "44" * 20
+
+def address_page(address, tag=""):
+    tag_span = f"<span>{tag}</span>" if tag else ""
+    return (
+        f'<html><body><main><section></section><section><span id="mainaddress">{address}</span></section>'
+        f"<section><div><div><a><div>{tag_span}</div></a></div></div></section></main></body></html>"
+    )
+
+class ExplorerStub(BaseHTTPRequestHandler):
+    """Serve Etherscan-like address pages, a rate limit response and a captcha page."""
+
+    requests = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        address = self.path.rsplit("/", 1)[-1]
+        self.requests.append(address)
+        status, body = 200, address_page(address)
+        if address == TAGGED:
+            body = address_page(address, "Stub: Tagged")
+        elif address == BUSY:
+            status, body = 429, "Too many requests"
+        elif address == CHALLENGE:
+            body = "<html><body>Just a moment...</body></html>"
+        content = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+def check(description, passed):
+    print(f"{description} {'✅' if passed else '❌'}")
+    return passed
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ExplorerStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # point the explorers and the label cache at the stub before hyperstats reads its constants
+    os.environ["ETHERSCAN_URL"] = os.environ["BASESCAN_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["EVENT_STORE_PATH"] = os.path.join(tempfile.mkdtemp(), "hyperstats.db")
+
+    from hyperstats.explorer import ExplorerTagClient, get_explorer_client
+    from hyperstats.query_holders import get_etherscan_tag
+
+    ok = check("get_explorer_client returns one shared client", get_explorer_client() is get_explorer_client())
+    ok &= check("tagged address returns its tag", get_etherscan_tag(TAGGED) == "Stub: Tagged")
+    ok &= check("untagged address returns no tag", get_etherscan_tag(UNTAGGED) == "")
+    ok &= check("rate limited address returns no tag", get_etherscan_tag(BUSY) == "")
+    ok &= check("captcha page returns no tag", get_etherscan_tag(CHALLENGE) == "")
+    ok &= check("captcha page is a failure, not an untagged address", get_explorer_client().fetch_tag("etherscan", CHALLENGE) is None)
+
+    # a fresh client reads tags and untagged addresses from the cache, but retries failures
+    ExplorerStub.requests.clear()
+    tags = ExplorerTagClient().get_tags("etherscan", [TAGGED, UNTAGGED, BUSY, CHALLENGE])
+    ok &= check("cached tags are returned", tags == ["Stub: Tagged", "", "", ""])
+    ok &= check("only failed lookups are requested again", sorted(ExplorerStub.requests) == sorted([BUSY, CHALLENGE]))
+
+    server.shutdown()
+    raise SystemExit(0 if ok else 1)